@@ -42,6 +42,11 @@ class ParamGroup:
         for arg in vars(args).items():
             if arg[0] in vars(self) or ("_" + arg[0]) in vars(self):
                 setattr(group, arg[0], arg[1])
+        # Options missing from args (e.g. cfg_args of an older run) keep their defaults
+        for key, value in vars(self).items():
+            key = key[1:] if key.startswith("_") else key
+            if not hasattr(group, key):
+                setattr(group, key, value)
         return group
 
 class ModelParams(ParamGroup): 
@@ -52,7 +57,17 @@ class ModelParams(ParamGroup):
         self._images = "images"
         self._resolution = -1
         self._white_background = False
-        self.data_device = "cuda"
+        self.data_device = ""
+        self.device = "cuda"
+        self.load_workers = 8
+        self.compact_images = False
+        self.lazy_images = False
+        self.image_cache_mb = 4096
+        self.prefetch_views = 4
+        self.image_disk_cache = ""
+        self.image_disk_cache_mb = 20480
+        self.image_store = ""
+        self.stream_min_views = 0
         self.eval = False
         super().__init__(parser, "Loading Parameters", sentinel)
 
@@ -66,6 +81,9 @@ class PipelineParams(ParamGroup):
         self.convert_SHs_python = False
         self.compute_cov3D_python = False
         self.debug = False
+        self.rasterizer = "cuda"
+        self.render_batch_size = 8
+        self.frustum_culling = False
         super().__init__(parser, "Pipeline Parameters")
 
 class OptimizationParams(ParamGroup):
@@ -0,0 +1,47 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use 
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import time
+from argparse import ArgumentParser
+from arguments import ModelParams, get_combined_args
+from scene import GaussianModel
+from scene.gaussian_hierarchy import GaussianHierarchy
+from utils.general_utils import safe_state
+from utils.system_utils import searchForMaxIteration
+
+def build_hierarchy(dataset : ModelParams, iteration : int, leaves_per_cell : int):
+    if iteration == -1:
+        iteration = searchForMaxIteration(os.path.join(dataset.model_path, "point_cloud"))
+    iteration_path = os.path.join(dataset.model_path, "point_cloud", "iteration_{}".format(iteration))
+
+    gaussians = GaussianModel(dataset.sh_degree, "cpu")
+    gaussians.load_ply(os.path.join(iteration_path, "point_cloud.ply"))
+    start = time.perf_counter()
+    hierarchy = GaussianHierarchy.build(gaussians, leaves_per_cell)
+    hierarchy.save(os.path.join(iteration_path, "hierarchy.bin"))
+    print("Built hierarchy of {} nodes over {} Gaussians, {} levels, in {:.1f}s".format(
+        len(hierarchy), gaussians.get_xyz.shape[0], len(hierarchy.levels) + 1, time.perf_counter() - start))
+
+if __name__ == "__main__":
+    # Set up command line argument parser
+    parser = ArgumentParser(description="Level of detail hierarchy parameters")
+    model = ModelParams(parser, sentinel=True)
+    parser.add_argument("--iteration", default=-1, type=int)
+    parser.add_argument("--leaves_per_cell", default=8, type=int)
+    parser.add_argument("--quiet", action="store_true")
+    args = get_combined_args(parser)
+    print("Building hierarchy for " + args.model_path)
+
+    # Initialize system state (RNG)
+    safe_state(args.quiet)
+
+    build_hierarchy(model.extract(args), args.iteration, args.leaves_per_cell)
@@ -10,9 +10,100 @@
 #
 
 import os
+import json
+import hashlib
 import logging
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 import shutil
+from PIL import Image
+
+RESIZE_FACTORS = [2, 4, 8]
+CONVERT_STAGES = ["feature_extraction", "feature_matching", "mapper", "image_undistortion"]
+
+def is_up_to_date(source_file, destination_file):
+    try:
+        return os.stat(destination_file).st_mtime_ns >= os.stat(source_file).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+def resize_image(source_path, file):
+    """Write images_2/4/8 versions of images/file from a single decode, skipping up to date ones."""
+    source_file = os.path.join(source_path, "images", file)
+    destinations = [(factor, os.path.join(source_path, "images_{}".format(factor), file)) for factor in RESIZE_FACTORS]
+    destinations = [(factor, destination_file) for factor, destination_file in destinations
+                    if not is_up_to_date(source_file, destination_file)]
+    if not destinations:
+        return 0
+
+    with Image.open(source_file) as image:
+        image_format = image.format
+        save_args = {key: image.info[key] for key in ("exif", "icc_profile", "dpi") if key in image.info}
+        if image_format == "JPEG":
+            save_args["quality"] = 95
+        image.load()
+        width, height = image.size
+        for factor, destination_file in destinations:
+            # Same output size as "magick mogrify -resize 50%/25%/12.5%"
+            size = (max(1, int(width / factor + 0.5)), max(1, int(height / factor + 0.5)))
+            # Written under a temporary name so an interrupted run never leaves a truncated, up to date looking file
+            tmp_file = destination_file + ".tmp"
+            image.resize(size, Image.LANCZOS).save(tmp_file, format=image_format, **save_args)
+            os.replace(tmp_file, destination_file)
+    return len(destinations)
+
+def file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as fid:
+        for block in iter(lambda: fid.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def hash_inputs(input_dir, previous):
+    """
+    Content hashes of the files below input_dir (COLMAP reads its image path
+    recursively), reusing previous ones for files with unchanged size and mtime.
+    """
+    inputs = {}
+    for root, _, files in sorted(os.walk(input_dir)):
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            if not os.path.isfile(path):
+                continue
+            name = os.path.relpath(path, input_dir)
+            stat = os.stat(path)
+            entry = previous.get(name)
+            if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+                entry = [stat.st_size, stat.st_mtime_ns, file_hash(path)]
+            inputs[name] = entry
+    return inputs
+
+def files_signature(folder):
+    """Sizes and mtimes of all files below folder."""
+    signature = []
+    for root, _, files in sorted(os.walk(folder)):
+        for file in sorted(files):
+            if not os.path.isfile(os.path.join(root, file)):
+                continue
+            stat = os.stat(os.path.join(root, file))
+            signature.append([os.path.relpath(os.path.join(root, file), folder), stat.st_size, stat.st_mtime_ns])
+    return signature
+
+def stage_key(*parts):
+    return hashlib.sha1(json.dumps(parts).encode("utf-8")).hexdigest()
+
+def load_manifest(path):
+    try:
+        with open(path) as fid:
+            return json.load(fid)
+    except (FileNotFoundError, ValueError):
+        return {"inputs": {}, "stages": {}}
+
+def save_manifest(path, manifest):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fid:
+        json.dump(manifest, fid, indent=1)
+    os.replace(tmp_path, path)
 
 # This Python script is based on the shell converter script provided in the MipNerF 360 repository.
 parser = ArgumentParser("Colmap converter")
@@ -22,103 +113,131 @@ parser.add_argument("--source_path", "-s", required=True, type=str)
 parser.add_argument("--camera", default="OPENCV", type=str)
 parser.add_argument("--colmap_executable", default="", type=str)
 parser.add_argument("--resize", action="store_true")
-parser.add_argument("--magick_executable", default="", type=str)
+parser.add_argument("--magick_executable", default="", type=str, help="Unused, images are resized in process")
+parser.add_argument("--resize_workers", default=os.cpu_count(), type=int)
+parser.add_argument("--force", action="store_true", help="Rerun all stages, ignoring the manifest")
 args = parser.parse_args()
 colmap_command = '"{}"'.format(args.colmap_executable) if len(args.colmap_executable) > 0 else "colmap"
-magick_command = '"{}"'.format(args.magick_executable) if len(args.magick_executable) > 0 else "magick"
 use_gpu = 1 if not args.no_gpu else 0
 
+# The manifest records a key per completed stage, derived from the input
+# images, the stage parameters and the key of the stage before it. A stage
+# whose key is unchanged and whose outputs still exist is skipped.
+manifest_path = os.path.join(args.source_path, "convert_manifest.json")
+manifest = load_manifest(manifest_path)
+
+def run_stage(name, key, outputs, run):
+    record = manifest["stages"].get(name)
+    if not args.force and record is not None and record["key"] == key \
+            and all(os.path.exists(os.path.join(args.source_path, output)) for output in record["outputs"]):
+        print("Skipping {}, outputs are up to date.".format(name))
+        return
+    # Forget the stage and the ones after it while it runs, so an interrupted
+    # run repeats it and later stages always see its new outputs
+    for stage in CONVERT_STAGES[CONVERT_STAGES.index(name):]:
+        manifest["stages"].pop(stage, None)
+    save_manifest(manifest_path, manifest)
+    run()
+    manifest["stages"][name] = {"key": key, "outputs": outputs}
+    save_manifest(manifest_path, manifest)
+
+def run_command(command, description):
+    exit_code = os.system(command)
+    if exit_code != 0:
+        logging.error(f"{description} failed with code {exit_code}. Exiting.")
+        exit(exit_code)
+
 if not args.skip_matching:
+    # Matching is expensive, so its inputs are identified by content and a
+    # touched but unchanged image does not rerun it
+    manifest["inputs"] = hash_inputs(os.path.join(args.source_path, "input"), manifest["inputs"])
+    save_manifest(manifest_path, manifest)
+    inputs_key = stage_key([[file, entry[2]] for file, entry in sorted(manifest["inputs"].items())])
     os.makedirs(args.source_path + "/distorted/sparse", exist_ok=True)
 
     ## Feature extraction
-    feat_extracton_cmd = colmap_command + " feature_extractor "\
-        "--database_path " + args.source_path + "/distorted/database.db \
-        --image_path " + args.source_path + "/input \
-        --ImageReader.single_camera 1 \
-        --ImageReader.camera_model " + args.camera + " \
-        --SiftExtraction.use_gpu " + str(use_gpu)
-    exit_code = os.system(feat_extracton_cmd)
-    if exit_code != 0:
-        logging.error(f"Feature extraction failed with code {exit_code}. Exiting.")
-        exit(exit_code)
+    def feature_extraction():
+        # Start from an empty database, COLMAP would keep stale features of changed images
+        if os.path.exists(args.source_path + "/distorted/database.db"):
+            os.remove(args.source_path + "/distorted/database.db")
+        feat_extracton_cmd = colmap_command + " feature_extractor "\
+            "--database_path " + args.source_path + "/distorted/database.db \
+            --image_path " + args.source_path + "/input \
+            --ImageReader.single_camera 1 \
+            --ImageReader.camera_model " + args.camera + " \
+            --SiftExtraction.use_gpu " + str(use_gpu)
+        run_command(feat_extracton_cmd, "Feature extraction")
+    extraction_key = stage_key("feature_extraction", inputs_key, args.camera)
+    run_stage("feature_extraction", extraction_key, ["distorted/database.db"], feature_extraction)
 
     ## Feature matching
-    feat_matching_cmd = colmap_command + " exhaustive_matcher \
-        --database_path " + args.source_path + "/distorted/database.db \
-        --SiftMatching.use_gpu " + str(use_gpu)
-    exit_code = os.system(feat_matching_cmd)
-    if exit_code != 0:
-        logging.error(f"Feature matching failed with code {exit_code}. Exiting.")
-        exit(exit_code)
+    def feature_matching():
+        feat_matching_cmd = colmap_command + " exhaustive_matcher \
+            --database_path " + args.source_path + "/distorted/database.db \
+            --SiftMatching.use_gpu " + str(use_gpu)
+        run_command(feat_matching_cmd, "Feature matching")
+    matching_key = stage_key("feature_matching", extraction_key)
+    run_stage("feature_matching", matching_key, ["distorted/database.db"], feature_matching)
 
     ### Bundle adjustment
-    # The default Mapper tolerance is unnecessarily large,
-    # decreasing it speeds up bundle adjustment steps.
-    mapper_cmd = (colmap_command + " mapper \
-        --database_path " + args.source_path + "/distorted/database.db \
-        --image_path "  + args.source_path + "/input \
-        --output_path "  + args.source_path + "/distorted/sparse \
-        --Mapper.ba_global_function_tolerance=0.000001")
-    exit_code = os.system(mapper_cmd)
-    if exit_code != 0:
-        logging.error(f"Mapper failed with code {exit_code}. Exiting.")
-        exit(exit_code)
+    def mapper():
+        # Models of a previous run would otherwise be mixed with the new ones
+        shutil.rmtree(args.source_path + "/distorted/sparse")
+        os.makedirs(args.source_path + "/distorted/sparse")
+        # The default Mapper tolerance is unnecessarily large,
+        # decreasing it speeds up bundle adjustment steps.
+        mapper_cmd = (colmap_command + " mapper \
+            --database_path " + args.source_path + "/distorted/database.db \
+            --image_path "  + args.source_path + "/input \
+            --output_path "  + args.source_path + "/distorted/sparse \
+            --Mapper.ba_global_function_tolerance=0.000001")
+        run_command(mapper_cmd, "Mapper")
+    mapper_key = stage_key("mapper", matching_key)
+    run_stage("mapper", mapper_key, ["distorted/sparse/0"], mapper)
+    undistortion_key = stage_key("image_undistortion", mapper_key)
+else:
+    # Externally provided reconstruction, the inputs and the model are
+    # identified by their file sizes and mtimes without reading them
+    undistortion_key = stage_key("image_undistortion", files_signature(os.path.join(args.source_path, "input")),
+                                 files_signature(os.path.join(args.source_path, "distorted", "sparse", "0")))
 
 ### Image undistortion
 ## We need to undistort our images into ideal pinhole intrinsics.
-img_undist_cmd = (colmap_command + " image_undistorter \
-    --image_path " + args.source_path + "/input \
-    --input_path " + args.source_path + "/distorted/sparse/0 \
-    --output_path " + args.source_path + "\
-    --output_type COLMAP")
-exit_code = os.system(img_undist_cmd)
-if exit_code != 0:
-    logging.error(f"Mapper failed with code {exit_code}. Exiting.")
-    exit(exit_code)
-
-files = os.listdir(args.source_path + "/sparse")
-os.makedirs(args.source_path + "/sparse/0", exist_ok=True)
-# Copy each file from the source directory to the destination directory
-for file in files:
-    if file == '0':
-        continue
-    source_file = os.path.join(args.source_path, "sparse", file)
-    destination_file = os.path.join(args.source_path, "sparse", "0", file)
-    shutil.move(source_file, destination_file)
+def image_undistortion():
+    img_undist_cmd = (colmap_command + " image_undistorter \
+        --image_path " + args.source_path + "/input \
+        --input_path " + args.source_path + "/distorted/sparse/0 \
+        --output_path " + args.source_path + "\
+        --output_type COLMAP")
+    run_command(img_undist_cmd, "Image undistortion")
+
+    files = os.listdir(args.source_path + "/sparse")
+    os.makedirs(args.source_path + "/sparse/0", exist_ok=True)
+    # Move each file from the source directory to the destination directory,
+    # replacing the files of a previous run
+    for file in files:
+        source_file = os.path.join(args.source_path, "sparse", file)
+        if file == '0' or not os.path.isfile(source_file):
+            continue
+        destination_file = os.path.join(args.source_path, "sparse", "0", file)
+        os.replace(source_file, destination_file)
+run_stage("image_undistortion", undistortion_key, ["images", "sparse/0"], image_undistortion)
 
 if(args.resize):
     print("Copying and resizing...")
 
     # Resize images.
-    os.makedirs(args.source_path + "/images_2", exist_ok=True)
-    os.makedirs(args.source_path + "/images_4", exist_ok=True)
-    os.makedirs(args.source_path + "/images_8", exist_ok=True)
+    for factor in RESIZE_FACTORS:
+        os.makedirs(args.source_path + "/images_{}".format(factor), exist_ok=True)
     # Get the list of files in the source directory
     files = os.listdir(args.source_path + "/images")
-    # Copy each file from the source directory to the destination directory
-    for file in files:
-        source_file = os.path.join(args.source_path, "images", file)
-
-        destination_file = os.path.join(args.source_path, "images_2", file)
-        shutil.copy2(source_file, destination_file)
-        exit_code = os.system(magick_command + " mogrify -resize 50% " + destination_file)
-        if exit_code != 0:
-            logging.error(f"50% resize failed with code {exit_code}. Exiting.")
-            exit(exit_code)
-
-        destination_file = os.path.join(args.source_path, "images_4", file)
-        shutil.copy2(source_file, destination_file)
-        exit_code = os.system(magick_command + " mogrify -resize 25% " + destination_file)
-        if exit_code != 0:
-            logging.error(f"25% resize failed with code {exit_code}. Exiting.")
-            exit(exit_code)
-
-        destination_file = os.path.join(args.source_path, "images_8", file)
-        shutil.copy2(source_file, destination_file)
-        exit_code = os.system(magick_command + " mogrify -resize 12.5% " + destination_file)
-        if exit_code != 0:
-            logging.error(f"12.5% resize failed with code {exit_code}. Exiting.")
-            exit(exit_code)
+    # Each image is decoded once and all its scales are written on a worker pool
+    with ThreadPoolExecutor(max_workers=max(1, args.resize_workers)) as executor:
+        try:
+            written = sum(executor.map(lambda file: resize_image(args.source_path, file), files))
+        except Exception as e:
+            logging.error(f"Resize failed: {e}. Exiting.")
+            exit(1)
+    print("Wrote {} resized images, {} were up to date.".format(written, len(files) * len(RESIZE_FACTORS) - written))
 
 print("Done.")
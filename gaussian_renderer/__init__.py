@@ -11,29 +11,30 @@
 
 import torch
 import math
-from diff_gaussian_rasterization import GaussianRasterizationSettings, GaussianRasterizer
+try:
+    from diff_gaussian_rasterization import GaussianRasterizationSettings, GaussianRasterizer
+    CUDA_RASTERIZER_FOUND = True
+except ImportError:
+    CUDA_RASTERIZER_FOUND = False
+from gaussian_renderer.torch_rasterizer import RasterizationSettings, TorchGaussianRasterizer
 from scene.gaussian_model import GaussianModel
 from utils.sh_utils import eval_sh
 
-def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, override_color = None):
-    """
-    Render the scene. 
-    
-    Background tensor (bg_color) must be on GPU!
-    """
- 
-    # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
-    screenspace_points = torch.zeros_like(pc.get_xyz, dtype=pc.get_xyz.dtype, requires_grad=True, device="cuda") + 0
-    try:
-        screenspace_points.retain_grad()
-    except:
-        pass
+def get_rasterizer(pipe):
+    """(settings type, rasterizer type) of the backend selected by pipe.rasterizer."""
+    if pipe.rasterizer == "torch":
+        return RasterizationSettings, TorchGaussianRasterizer
+    if pipe.rasterizer != "cuda":
+        raise ValueError("Unknown rasterizer: {}".format(pipe.rasterizer))
+    if not CUDA_RASTERIZER_FOUND:
+        raise ImportError("diff_gaussian_rasterization is not installed, use --rasterizer torch")
+    return GaussianRasterizationSettings, GaussianRasterizer
 
-    # Set up rasterization configuration
+def raster_settings_for(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor, RasterizationSettings, scaling_modifier = 1.0):
     tanfovx = math.tan(viewpoint_camera.FoVx * 0.5)
     tanfovy = math.tan(viewpoint_camera.FoVy * 0.5)
 
-    raster_settings = GaussianRasterizationSettings(
+    return RasterizationSettings(
         image_height=int(viewpoint_camera.image_height),
         image_width=int(viewpoint_camera.image_width),
         tanfovx=tanfovx,
@@ -48,12 +49,8 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
         debug=pipe.debug
     )
 
-    rasterizer = GaussianRasterizer(raster_settings=raster_settings)
-
-    means3D = pc.get_xyz
-    means2D = screenspace_points
-    opacity = pc.get_opacity
-
+def gaussian_inputs(pc : GaussianModel, pipe, scaling_modifier = 1.0):
+    """Activated per Gaussian rasterizer inputs: means3D, opacity, scales, rotations, cov3D_precomp."""
     # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
     # scaling / rotation by the rasterizer.
     scales = None
@@ -64,22 +61,67 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
     else:
         scales = pc.get_scaling
         rotations = pc.get_rotation
+    return pc.get_xyz, pc.get_opacity, scales, rotations, cov3D_precomp
 
+def gaussian_colors(camera_centers, pc : GaussianModel, pipe, override_color = None):
+    """
+    (shs, colors_precomp) for the rasterizer. Colors converted from SHs in
+    Python have one leading dimension per row of camera_centers.
+    """
     # If precomputed colors are provided, use them. Otherwise, if it is desired to precompute colors
     # from SHs in Python, do it. If not, then SH -> RGB conversion will be done by rasterizer.
-    shs = None
-    colors_precomp = None
-    if override_color is None:
-        if pipe.convert_SHs_python:
-            shs_view = pc.get_features.transpose(1, 2).view(-1, 3, (pc.max_sh_degree+1)**2)
-            dir_pp = (pc.get_xyz - viewpoint_camera.camera_center.repeat(pc.get_features.shape[0], 1))
-            dir_pp_normalized = dir_pp/dir_pp.norm(dim=1, keepdim=True)
-            sh2rgb = eval_sh(pc.active_sh_degree, shs_view, dir_pp_normalized)
-            colors_precomp = torch.clamp_min(sh2rgb + 0.5, 0.0)
-        else:
-            shs = pc.get_features
-    else:
-        colors_precomp = override_color
+    if override_color is not None:
+        return None, override_color
+    features = pc.get_features
+    if not pipe.convert_SHs_python:
+        return features, None
+    shs_view = features.transpose(1, 2).view(-1, 3, (pc.max_sh_degree+1)**2)
+    dir_pp = (pc.get_xyz - camera_centers[..., None, :])
+    dir_pp_normalized = dir_pp/dir_pp.norm(dim=-1, keepdim=True)
+    sh2rgb = eval_sh(pc.active_sh_degree, shs_view, dir_pp_normalized)
+    return None, torch.clamp_min(sh2rgb + 0.5, 0.0)
+
+def cull_inputs(visible, *tensors):
+    """Rows of the per Gaussian tensors kept by visible, all of them if visible is None."""
+    if visible is None:
+        return tensors
+    return tuple(None if tensor is None else tensor[visible] for tensor in tensors)
+
+def uncull_radii(visible, radii, num_points):
+    """Radii of all Gaussians, 0 for the culled ones."""
+    if visible is None:
+        return radii
+    full_radii = torch.zeros(radii.shape[:-1] + (num_points,), dtype=radii.dtype, device=radii.device)
+    full_radii[..., visible] = radii
+    return full_radii
+
+def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, override_color = None):
+    """
+    Render the scene. 
+    
+    Background tensor (bg_color) must be on GPU (on the scene's device for the torch rasterizer)!
+    """
+ 
+    # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
+    screenspace_points = torch.zeros_like(pc.get_xyz, dtype=pc.get_xyz.dtype, requires_grad=True, device=pc.get_xyz.device) + 0
+    try:
+        screenspace_points.retain_grad()
+    except:
+        pass
+
+    # Set up rasterization configuration
+    RasterizationSettings, Rasterizer = get_rasterizer(pipe)
+    raster_settings = raster_settings_for(viewpoint_camera, pc, pipe, bg_color, RasterizationSettings, scaling_modifier)
+    rasterizer = Rasterizer(raster_settings=raster_settings)
+
+    means3D, opacity, scales, rotations, cov3D_precomp = gaussian_inputs(pc, pipe, scaling_modifier)
+    shs, colors_precomp = gaussian_colors(viewpoint_camera.camera_center, pc, pipe, override_color)
+
+    # Only pass the Gaussians of grid cells that can be seen, gradients and
+    # radii still cover all of them
+    visible = pc.visible_gaussians([viewpoint_camera], scaling_modifier) if pipe.frustum_culling else None
+    means3D, means2D, opacity, scales, rotations, cov3D_precomp, shs, colors_precomp = cull_inputs(
+        visible, means3D, screenspace_points, opacity, scales, rotations, cov3D_precomp, shs, colors_precomp)
 
     # Rasterize visible Gaussians to image, obtain their radii (on screen). 
     rendered_image, radii = rasterizer(
@@ -91,6 +133,7 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
         scales = scales,
         rotations = rotations,
         cov3D_precomp = cov3D_precomp)
+    radii = uncull_radii(visible, radii, pc.get_xyz.shape[0])
 
     # Those Gaussians that were frustum culled or had a radius of 0 were not visible.
     # They will be excluded from value updates used in the splitting criteria.
@@ -98,3 +141,69 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
             "viewspace_points": screenspace_points,
             "visibility_filter" : radii > 0,
             "radii": radii}
+
+def render_batch(viewpoint_cameras, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, override_color = None):
+    """
+    Render several views of the scene, the per Gaussian activations and
+    features are evaluated once for all of them. The cameras must share one
+    image size; every output is stacked along a leading view dimension.
+    override_color may be (P, 3) or hold one (P, 3) slice per view.
+    """
+    if len({(int(cam.image_height), int(cam.image_width)) for cam in viewpoint_cameras}) != 1:
+        raise ValueError("render_batch needs at least one camera and a common image size, see camera_batches")
+
+    # One slice of screen-space means per view, their gradients are kept apart
+    screenspace_points = torch.zeros((len(viewpoint_cameras),) + pc.get_xyz.shape, dtype=pc.get_xyz.dtype, requires_grad=True, device=pc.get_xyz.device) + 0
+    try:
+        screenspace_points.retain_grad()
+    except:
+        pass
+
+    RasterizationSettings, Rasterizer = get_rasterizer(pipe)
+    raster_settings = [raster_settings_for(cam, pc, pipe, bg_color, RasterizationSettings, scaling_modifier) for cam in viewpoint_cameras]
+
+    means3D, opacity, scales, rotations, cov3D_precomp = gaussian_inputs(pc, pipe, scaling_modifier)
+    camera_centers = torch.stack([cam.camera_center for cam in viewpoint_cameras])
+    shs, colors_precomp = gaussian_colors(camera_centers, pc, pipe, override_color)
+
+    # Gaussians in cells seen by none of the views are skipped for all of them
+    visible = pc.visible_gaussians(viewpoint_cameras, scaling_modifier) if pipe.frustum_culling else None
+    means3D, opacity, scales, rotations, cov3D_precomp, shs = cull_inputs(
+        visible, means3D, opacity, scales, rotations, cov3D_precomp, shs)
+    means2D = screenspace_points if visible is None else screenspace_points[:, visible]
+    if visible is not None and colors_precomp is not None:
+        colors_precomp = colors_precomp[..., visible, :]
+
+    # Backends that can share work between views expose rasterize_views,
+    # the others rasterize the views one by one on the shared inputs
+    if hasattr(Rasterizer, "rasterize_views"):
+        rendered_images, radii = Rasterizer.rasterize_views(
+            raster_settings, means3D = means3D, means2D = means2D, shs = shs, colors_precomp = colors_precomp,
+            opacities = opacity, scales = scales, rotations = rotations, cov3D_precomp = cov3D_precomp)
+    else:
+        rendered_images, radii = [], []
+        for idx, settings in enumerate(raster_settings):
+            colors = colors_precomp[idx] if colors_precomp is not None and colors_precomp.dim() == 3 else colors_precomp
+            image, view_radii = Rasterizer(raster_settings=settings)(
+                means3D = means3D, means2D = means2D[idx], shs = shs, colors_precomp = colors,
+                opacities = opacity, scales = scales, rotations = rotations, cov3D_precomp = cov3D_precomp)
+            rendered_images.append(image)
+            radii.append(view_radii)
+        rendered_images, radii = torch.stack(rendered_images), torch.stack(radii)
+    radii = uncull_radii(visible, radii, pc.get_xyz.shape[0])
+
+    return {"render": rendered_images,
+            "viewspace_points": screenspace_points,
+            "visibility_filter" : radii > 0,
+            "radii": radii}
+
+def camera_batches(cameras, batch_size):
+    """Consecutive runs of at most batch_size cameras that share an image size, as accepted by render_batch."""
+    batch = []
+    for cam in cameras:
+        if batch and (len(batch) >= batch_size or (cam.image_height, cam.image_width) != (batch[0].image_height, batch[0].image_width)):
+            yield batch
+            batch = []
+        batch.append(cam)
+    if batch:
+        yield batch
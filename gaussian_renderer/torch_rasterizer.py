@@ -0,0 +1,220 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import torch
+from typing import NamedTuple
+from utils.sh_utils import eval_sh
+
+# Reference implementation of the diff_gaussian_rasterization forward pass in
+# plain PyTorch: same culling, 2D covariance, tile binning, depth order and
+# front-to-back compositing rules, differentiable through autograd. It runs
+# on any device and is meant for machines without the CUDA extension.
+
+BLOCK_X = 16
+BLOCK_Y = 16
+
+class RasterizationSettings(NamedTuple):
+    image_height: int
+    image_width: int
+    tanfovx : float
+    tanfovy : float
+    bg : torch.Tensor
+    scale_modifier : float
+    viewmatrix : torch.Tensor
+    projmatrix : torch.Tensor
+    sh_degree : int
+    campos : torch.Tensor
+    prefiltered : bool
+    debug : bool
+
+def quaternion_to_matrix(q):
+    r, x, y, z = q.unbind(-1)
+    return torch.stack((
+        1 - 2 * (y * y + z * z), 2 * (x * y - r * z), 2 * (x * z + r * y),
+        2 * (x * y + r * z), 1 - 2 * (x * x + z * z), 2 * (y * z - r * x),
+        2 * (x * z - r * y), 2 * (y * z + r * x), 1 - 2 * (x * x + y * y)), dim=-1).reshape(-1, 3, 3)
+
+def unstrip_symmetric(cov):
+    xx, xy, xz, yy, yz, zz = cov.unbind(-1)
+    return torch.stack((xx, xy, xz, xy, yy, yz, xz, yz, zz), dim=-1).reshape(-1, 3, 3)
+
+def compute_cov3D(scales, rotations, scale_modifier):
+    M = quaternion_to_matrix(rotations) * (scales * scale_modifier)[:, None, :]
+    return M @ M.transpose(1, 2)
+
+def compute_cov2D(p_view, cov3D, settings):
+    focal_x = settings.image_width / (2.0 * settings.tanfovx)
+    focal_y = settings.image_height / (2.0 * settings.tanfovy)
+    limx = 1.3 * settings.tanfovx
+    limy = 1.3 * settings.tanfovy
+    tz = p_view[:, 2]
+    tx = (p_view[:, 0] / tz).clamp(-limx, limx) * tz
+    ty = (p_view[:, 1] / tz).clamp(-limy, limy) * tz
+
+    zeros = torch.zeros_like(tz)
+    J = torch.stack((focal_x / tz, zeros, -(focal_x * tx) / (tz * tz),
+                     zeros, focal_y / tz, -(focal_y * ty) / (tz * tz)), dim=-1).reshape(-1, 2, 3)
+    # The view matrix is stored transposed (row vector convention)
+    T = J @ settings.viewmatrix[:3, :3].transpose(0, 1)
+    cov = T @ cov3D @ T.transpose(1, 2)
+    # Low pass filter, every Gaussian covers at least one pixel
+    return cov[:, 0, 0] + 0.3, cov[:, 0, 1], cov[:, 1, 1] + 0.3
+
+def gaussian_cov3D(scales, rotations, cov3D_precomp, scale_modifier):
+    if cov3D_precomp is not None:
+        return unstrip_symmetric(cov3D_precomp)
+    return compute_cov3D(scales, rotations, scale_modifier)
+
+def sh_colors(sh_degree, shs, means3D, campos):
+    """RGB of every Gaussian seen from campos, (..., P, 3) for campos of shape (..., 3)."""
+    dirs = means3D - campos[..., None, :]
+    dirs = dirs / dirs.norm(dim=-1, keepdim=True)
+    return torch.clamp_min(eval_sh(sh_degree, shs.transpose(1, 2), dirs) + 0.5, 0.0)
+
+def preprocess(means3D, means2D, opacities, shs, colors_precomp, cov3D, settings):
+    """Per Gaussian screen space quantities, radii are 0 for culled Gaussians."""
+    ones = torch.ones_like(means3D[:, :1])
+    p_hom4 = torch.cat((means3D, ones), dim=1)
+    p_view = p_hom4 @ settings.viewmatrix
+    p_hom = p_hom4 @ settings.projmatrix
+    p_proj = p_hom[:, :3] / (p_hom[:, 3:4] + 0.0000001)
+    # means2D only receives the gradient of the (NDC) screen space position
+    p_proj = p_proj + means2D
+
+    # Gaussians behind the near plane are culled, keep their math finite
+    in_frustum = p_view[:, 2] > 0.2
+    a, b, c = compute_cov2D(torch.where(in_frustum[:, None], p_view, torch.ones_like(p_view)), cov3D, settings)
+    det = a * c - b * b
+    det_safe = torch.where(det == 0, torch.ones_like(det), det)
+    conic = torch.stack((c / det_safe, -b / det_safe, a / det_safe), dim=-1)
+
+    with torch.no_grad():
+        mid = 0.5 * (a + c)
+        lambda1 = mid + torch.sqrt(torch.clamp_min(mid * mid - det, 0.1))
+        radii = torch.ceil(3.0 * torch.sqrt(lambda1))
+
+    point_image = torch.stack((((p_proj[:, 0] + 1.0) * settings.image_width - 1.0) * 0.5,
+                               ((p_proj[:, 1] + 1.0) * settings.image_height - 1.0) * 0.5), dim=-1)
+
+    with torch.no_grad():
+        grid_x = (settings.image_width + BLOCK_X - 1) // BLOCK_X
+        grid_y = (settings.image_height + BLOCK_Y - 1) // BLOCK_Y
+        rect_min_x = torch.floor((point_image[:, 0] - radii) / BLOCK_X).clamp(0, grid_x)
+        rect_min_y = torch.floor((point_image[:, 1] - radii) / BLOCK_Y).clamp(0, grid_y)
+        rect_max_x = torch.floor((point_image[:, 0] + radii + BLOCK_X - 1) / BLOCK_X).clamp(0, grid_x)
+        rect_max_y = torch.floor((point_image[:, 1] + radii + BLOCK_Y - 1) / BLOCK_Y).clamp(0, grid_y)
+        rect = torch.stack((rect_min_x, rect_min_y, rect_max_x, rect_max_y), dim=-1).long()
+        visible = in_frustum & (det != 0) \
+            & ((rect[:, 2] - rect[:, 0]) * (rect[:, 3] - rect[:, 1]) != 0)
+        radii = torch.where(visible, radii, torch.zeros_like(radii)).int()
+
+    if colors_precomp is None:
+        colors_precomp = sh_colors(settings.sh_degree, shs, means3D, settings.campos)
+
+    return point_image, p_view[:, 2], conic, opacities[:, 0], colors_precomp, radii, rect
+
+def bin_gaussians(depths, radii, rect, grid_x):
+    """(tile id, Gaussian id) pairs of all overlaps, sorted by tile and then by depth."""
+    ids = torch.nonzero(radii > 0).squeeze(1)
+    rect = rect[ids]
+    widths = rect[:, 2] - rect[:, 0]
+    counts = widths * (rect[:, 3] - rect[:, 1])
+    owner = torch.repeat_interleave(torch.arange(len(ids), device=ids.device), counts)
+    local = torch.arange(len(owner), device=ids.device) - torch.repeat_interleave(torch.cumsum(counts, 0) - counts, counts)
+    tile_x = rect[owner, 0] + local % widths[owner]
+    tile_y = rect[owner, 1] + local // widths[owner]
+    tiles = tile_y * grid_x + tile_x
+    gaussians = ids[owner]
+
+    order = torch.sort(depths[gaussians], stable=True)[1]
+    order = order[torch.sort(tiles[order], stable=True)[1]]
+    return tiles[order], gaussians[order]
+
+def composite_tile(pixels, point_image, conic, opacity, colors, bg):
+    """Front to back alpha blending of depth sorted Gaussians over a block of pixels."""
+    d = point_image[None] - pixels[:, None]
+    power = -0.5 * (conic[None, :, 0] * d[..., 0] * d[..., 0] + conic[None, :, 2] * d[..., 1] * d[..., 1]) \
+        - conic[None, :, 1] * d[..., 0] * d[..., 1]
+    alpha = torch.clamp_max(opacity[None] * torch.exp(torch.clamp_max(power, 0.0)), 0.99)
+    alpha = torch.where((power <= 0) & (alpha >= 1.0 / 255.0), alpha, torch.zeros_like(alpha))
+
+    # A pixel stops at the first Gaussian that would drop its transmittance
+    # below 1e-4; transmittance never increases, so the kept ones are a prefix.
+    T = torch.cumprod(1 - alpha, dim=1)
+    keep = (T >= 0.0001).detach()
+    alpha = alpha * keep
+    T = torch.cumprod(1 - alpha, dim=1)
+    T_before = torch.cat((torch.ones_like(T[:, :1]), T[:, :-1]), dim=1)
+    color = (alpha * T_before) @ colors
+    return color + T[:, -1:] * bg[None]
+
+def check_inputs(shs, colors_precomp, scales, rotations, cov3D_precomp):
+    if (shs is None and colors_precomp is None) or (shs is not None and colors_precomp is not None):
+        raise Exception('Please provide excatly one of either SHs or precomputed colors!')
+    if ((scales is None or rotations is None) and cov3D_precomp is None) or ((scales is not None or rotations is not None) and cov3D_precomp is not None):
+        raise Exception('Please provide exactly one of either scale/rotation pair or precomputed 3D covariance!')
+
+def rasterize(settings, means3D, means2D, opacities, shs, colors_precomp, cov3D):
+    point_image, depths, conic, opacity, colors, radii, rect = preprocess(
+        means3D, means2D, opacities, shs, colors_precomp, cov3D, settings)
+
+    height, width = settings.image_height, settings.image_width
+    grid_x = (width + BLOCK_X - 1) // BLOCK_X
+    tiles, gaussians = bin_gaussians(depths.detach(), radii, rect, grid_x)
+
+    device = means3D.device
+    image = settings.bg[:, None, None].expand(3, height, width).clone()
+    if len(tiles) > 0:
+        tile_ids, counts = torch.unique_consecutive(tiles, return_counts=True)
+        starts = torch.cumsum(counts, 0) - counts
+        offsets_y, offsets_x = torch.meshgrid(torch.arange(BLOCK_Y, device=device), torch.arange(BLOCK_X, device=device), indexing="ij")
+        for tile, start, count in zip(tile_ids.tolist(), starts.tolist(), counts.tolist()):
+            x0 = (tile % grid_x) * BLOCK_X
+            y0 = (tile // grid_x) * BLOCK_Y
+            w = min(BLOCK_X, width - x0)
+            h = min(BLOCK_Y, height - y0)
+            pixels = torch.stack(((offsets_x[:h, :w] + x0).reshape(-1), (offsets_y[:h, :w] + y0).reshape(-1)), dim=-1).to(point_image.dtype)
+            ids = gaussians[start:start + count]
+            color = composite_tile(pixels, point_image[ids], conic[ids], opacity[ids], colors[ids], settings.bg)
+            image[:, y0:y0 + h, x0:x0 + w] = color.transpose(0, 1).reshape(3, h, w)
+
+    return image, radii
+
+class TorchGaussianRasterizer:
+    """Drop-in replacement for diff_gaussian_rasterization.GaussianRasterizer."""
+
+    def __init__(self, raster_settings):
+        self.raster_settings = raster_settings
+
+    def __call__(self, means3D, means2D, opacities, shs = None, colors_precomp = None, scales = None, rotations = None, cov3D_precomp = None):
+        check_inputs(shs, colors_precomp, scales, rotations, cov3D_precomp)
+        cov3D = gaussian_cov3D(scales, rotations, cov3D_precomp, self.raster_settings.scale_modifier)
+        return rasterize(self.raster_settings, means3D, means2D, opacities, shs, colors_precomp, cov3D)
+
+    @staticmethod
+    def rasterize_views(raster_settings, means3D, means2D, opacities, shs = None, colors_precomp = None, scales = None, rotations = None, cov3D_precomp = None):
+        """
+        Render one view per entry of raster_settings, means2D holds one
+        (P, 3) slice per view and colors_precomp may too. The 3D covariances
+        and the SH colors of all views are computed in one pass each.
+        """
+        check_inputs(shs, colors_precomp, scales, rotations, cov3D_precomp)
+        cov3D = gaussian_cov3D(scales, rotations, cov3D_precomp, raster_settings[0].scale_modifier)
+        if shs is not None:
+            campos = torch.stack([settings.campos for settings in raster_settings])
+            colors_precomp = sh_colors(raster_settings[0].sh_degree, shs, means3D, campos)
+        images, radii = [], []
+        for idx, settings in enumerate(raster_settings):
+            colors = colors_precomp[idx] if colors_precomp.dim() == 3 else colors_precomp
+            image, view_radii = rasterize(settings, means3D, means2D[idx], opacities, None, colors, cov3D)
+            images.append(image)
+            radii.append(view_radii)
+        return torch.stack(images), torch.stack(radii)
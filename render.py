@@ -14,39 +14,85 @@ from scene import Scene
 import os
 from tqdm import tqdm
 from os import makedirs
-from gaussian_renderer import render
+import time
+from gaussian_renderer import render, render_batch, camera_batches
 import torchvision
 from utils.general_utils import safe_state
+from utils.image_utils import psnr
 from argparse import ArgumentParser
 from arguments import ModelParams, PipelineParams, get_combined_args
 from gaussian_renderer import GaussianModel
+from scene.gaussian_hierarchy import GaussianHierarchy
 
-def render_set(model_path, name, iteration, views, gaussians, pipeline, background):
-    render_path = os.path.join(model_path, name, "ours_{}".format(iteration), "renders")
-    gts_path = os.path.join(model_path, name, "ours_{}".format(iteration), "gt")
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize()
+
+def render_set(model_path, name, iteration, views, gaussians, pipeline, background, hierarchy=None, lod_threshold=0.0):
+    method = "ours_{}".format(iteration) if hierarchy is None else "ours_{}_lod_{}".format(iteration, lod_threshold)
+    render_path = os.path.join(model_path, name, method, "renders")
+    gts_path = os.path.join(model_path, name, method, "gt")
 
     makedirs(render_path, exist_ok=True)
     makedirs(gts_path, exist_ok=True)
 
-    for idx, view in enumerate(tqdm(views, desc="Rendering progress")):
-        rendering = render(view, gaussians, pipeline, background)["render"]
-        gt = view.original_image[0:3, :, :]
-        torchvision.utils.save_image(rendering, os.path.join(render_path, '{0:05d}'.format(idx) + ".png"))
-        torchvision.utils.save_image(gt, os.path.join(gts_path, '{0:05d}'.format(idx) + ".png"))
+    idx = 0
+    render_time = 0.0
+    num_rendered = 0
+    # With a hierarchy, the full model is rendered as well for the comparison
+    full_time = 0.0
+    psnr_vs_full = 0.0
+    with tqdm(total=len(views), desc="Rendering progress") as progress_bar:
+        for batch in camera_batches(views, 1 if hierarchy is not None else pipeline.render_batch_size):
+            synchronize(gaussians.device)
+            start = time.perf_counter()
+            if hierarchy is not None:
+                # One cut per view, selected on the CPU
+                cut = hierarchy.cut_model(hierarchy.cut(batch[0], lod_threshold), gaussians.device)
+                renderings = render(batch[0], cut, pipeline, background)["render"][None]
+                num_rendered += cut.get_xyz.shape[0]
+            else:
+                renderings = render_batch(batch, gaussians, pipeline, background)["render"]
+                num_rendered += gaussians.get_xyz.shape[0] * len(batch)
+            synchronize(gaussians.device)
+            render_time += time.perf_counter() - start
+            if hierarchy is not None:
+                start = time.perf_counter()
+                full_rendering = render(batch[0], gaussians, pipeline, background)["render"]
+                synchronize(gaussians.device)
+                full_time += time.perf_counter() - start
+                psnr_vs_full += psnr(renderings, full_rendering[None]).item()
+            for rendering, view in zip(renderings, batch):
+                gt = view.original_image[0:3, :, :]
+                torchvision.utils.save_image(rendering, os.path.join(render_path, '{0:05d}'.format(idx) + ".png"))
+                torchvision.utils.save_image(gt, os.path.join(gts_path, '{0:05d}'.format(idx) + ".png"))
+                idx += 1
+            progress_bar.update(len(batch))
+
+    if views:
+        print("{} {}: {:.2f} FPS, {:.0f} Gaussians per view".format(name, method, len(views) / render_time, num_rendered / len(views)))
+        if hierarchy is not None:
+            print("{} {}: full model {:.2f} FPS, {:.0f} Gaussians, PSNR vs full {:.2f} dB".format(
+                name, method, len(views) / full_time, gaussians.get_xyz.shape[0], psnr_vs_full / len(views)))
 
-def render_sets(dataset : ModelParams, iteration : int, pipeline : PipelineParams, skip_train : bool, skip_test : bool):
+def render_sets(dataset : ModelParams, iteration : int, pipeline : PipelineParams, skip_train : bool, skip_test : bool, lod_threshold : float):
     with torch.no_grad():
-        gaussians = GaussianModel(dataset.sh_degree)
+        gaussians = GaussianModel(dataset.sh_degree, dataset.device)
         scene = Scene(dataset, gaussians, load_iteration=iteration, shuffle=False)
 
         bg_color = [1,1,1] if dataset.white_background else [0, 0, 0]
-        background = torch.tensor(bg_color, dtype=torch.float32, device="cuda")
+        background = torch.tensor(bg_color, dtype=torch.float32, device=dataset.device)
+
+        hierarchy = None
+        if lod_threshold > 0:
+            hierarchy = GaussianHierarchy.load(os.path.join(dataset.model_path, "point_cloud",
+                                                            "iteration_" + str(scene.loaded_iter), "hierarchy.bin"))
 
         if not skip_train:
-             render_set(dataset.model_path, "train", scene.loaded_iter, scene.getTrainCameras(), gaussians, pipeline, background)
+             render_set(dataset.model_path, "train", scene.loaded_iter, scene.getTrainCameras(), gaussians, pipeline, background, hierarchy, lod_threshold)
 
         if not skip_test:
-             render_set(dataset.model_path, "test", scene.loaded_iter, scene.getTestCameras(), gaussians, pipeline, background)
+             render_set(dataset.model_path, "test", scene.loaded_iter, scene.getTestCameras(), gaussians, pipeline, background, hierarchy, lod_threshold)
 
 if __name__ == "__main__":
     # Set up command line argument parser
@@ -57,10 +103,11 @@ if __name__ == "__main__":
     parser.add_argument("--skip_train", action="store_true")
     parser.add_argument("--skip_test", action="store_true")
     parser.add_argument("--quiet", action="store_true")
+    parser.add_argument("--lod_threshold", default=0.0, type=float)
     args = get_combined_args(parser)
     print("Rendering " + args.model_path)
 
     # Initialize system state (RNG)
     safe_state(args.quiet)
 
-    render_sets(model.extract(args), args.iteration, pipeline.extract(args), args.skip_train, args.skip_test)
\ No newline at end of file
+    render_sets(model.extract(args), args.iteration, pipeline.extract(args), args.skip_train, args.skip_test, args.lod_threshold)
\ No newline at end of file
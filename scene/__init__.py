@@ -12,19 +12,26 @@
 import os
 import random
 import json
-from utils.system_utils import searchForMaxIteration
+import threading
+from utils.system_utils import searchForMaxIteration, copy_if_changed
 from scene.dataset_readers import sceneLoadTypeCallbacks
+from scene.scene_index import load_scene_index, save_scene_index
 from scene.gaussian_model import GaussianModel
 from arguments import ModelParams
-from utils.camera_utils import cameraList_from_camInfos, camera_to_JSON
+from utils.camera_utils import cameraLists_from_camInfos, camera_to_JSON
+from utils.image_cache import ImageCache
+from utils.image_disk_cache import ImageDiskCache
+from utils.image_store import ImageStore
 
 class Scene:
 
     gaussians : GaussianModel
 
-    def __init__(self, args : ModelParams, gaussians : GaussianModel, load_iteration=None, shuffle=True, resolution_scales=[1.0]):
+    def __init__(self, args : ModelParams, gaussians : GaussianModel, load_iteration=None, shuffle=True, resolution_scales=[1.0], stream=False):
         """b
         :param path: Path to colmap scene main folder.
+        :param stream: Return once args.stream_min_views training views are
+            loaded, the remaining cameras are appended in the background.
         """
         self.model_path = args.model_path
         self.loaded_iter = None
@@ -41,26 +48,42 @@ class Scene:
         self.test_cameras = {}
 
         if os.path.exists(os.path.join(args.source_path, "sparse")):
-            scene_info = sceneLoadTypeCallbacks["Colmap"](args.source_path, args.images, args.eval)
+            index_params = {"type": "Colmap", "source_path": os.path.abspath(args.source_path),
+                            "images": args.images, "eval": args.eval}
         elif os.path.exists(os.path.join(args.source_path, "transforms_train.json")):
             print("Found transforms_train.json file, assuming Blender data set!")
-            scene_info = sceneLoadTypeCallbacks["Blender"](args.source_path, args.white_background, args.eval)
+            index_params = {"type": "Blender", "source_path": os.path.abspath(args.source_path),
+                            "white_background": args.white_background, "eval": args.eval}
         else:
             assert False, "Could not recognize scene type!"
 
+        # Camera metadata of a previous run is reused while the source files are unchanged
+        index_path = os.path.join(self.model_path, "scene_index.bin")
+        scene_info = load_scene_index(index_path, index_params, not self.loaded_iter)
+        from_index = scene_info is not None
+        if from_index:
+            print("Loaded scene index " + index_path)
+        elif index_params["type"] == "Colmap":
+            scene_info = sceneLoadTypeCallbacks["Colmap"](args.source_path, args.images, args.eval)
+        else:
+            scene_info = sceneLoadTypeCallbacks["Blender"](args.source_path, args.white_background, args.eval, num_workers=args.load_workers)
+        if not from_index:
+            save_scene_index(index_path, scene_info, index_params)
+
         if not self.loaded_iter:
-            with open(scene_info.ply_path, 'rb') as src_file, open(os.path.join(self.model_path, "input.ply") , 'wb') as dest_file:
-                dest_file.write(src_file.read())
-            json_cams = []
-            camlist = []
-            if scene_info.test_cameras:
-                camlist.extend(scene_info.test_cameras)
-            if scene_info.train_cameras:
-                camlist.extend(scene_info.train_cameras)
-            for id, cam in enumerate(camlist):
-                json_cams.append(camera_to_JSON(id, cam))
-            with open(os.path.join(self.model_path, "cameras.json"), 'w') as file:
-                json.dump(json_cams, file)
+            copy_if_changed(scene_info.ply_path, os.path.join(self.model_path, "input.ply"))
+            cameras_json_path = os.path.join(self.model_path, "cameras.json")
+            if not (from_index and os.path.exists(cameras_json_path)):
+                json_cams = []
+                camlist = []
+                if scene_info.test_cameras:
+                    camlist.extend(scene_info.test_cameras)
+                if scene_info.train_cameras:
+                    camlist.extend(scene_info.train_cameras)
+                for id, cam in enumerate(camlist):
+                    json_cams.append(camera_to_JSON(id, cam))
+                with open(cameras_json_path, 'w') as file:
+                    json.dump(json_cams, file)
 
         if shuffle:
             random.shuffle(scene_info.train_cameras)  # Multi-res consistent random shuffling
@@ -68,11 +91,28 @@ class Scene:
 
         self.cameras_extent = scene_info.nerf_normalization["radius"]
 
-        for resolution_scale in resolution_scales:
-            print("Loading Training Cameras")
-            self.train_cameras[resolution_scale] = cameraList_from_camInfos(scene_info.train_cameras, resolution_scale, args)
-            print("Loading Test Cameras")
-            self.test_cameras[resolution_scale] = cameraList_from_camInfos(scene_info.test_cameras, resolution_scale, args)
+        # With lazy images, cameras fetch their images on demand through a shared LRU cache
+        self.image_cache = ImageCache(args.image_cache_mb * 1024 * 1024) if args.lazy_images else None
+        # Decoded, resized images persisted across runs
+        disk_cache = ImageDiskCache(args.image_disk_cache, args.image_disk_cache_mb * 1024 * 1024) if args.image_disk_cache else None
+        # Out-of-core mode: all images live in one memory-mapped file and are read on demand
+        self.image_store = ImageStore(args.image_store) if args.image_store else None
+
+        # All resolution scales are built from a single decode of each image
+        self.train_cameras = {resolution_scale: [] for resolution_scale in resolution_scales}
+        self.test_cameras = {resolution_scale: [] for resolution_scale in resolution_scales}
+        self.loaded_views = 0
+        self.loading_done = False
+        self.loading_error = None
+        self.loading_condition = threading.Condition()
+        loader_args = (scene_info, resolution_scales, args, disk_cache)
+        if stream:
+            # The extent only depends on camera metadata, so training can start
+            # on the first views while the others are still being decoded
+            threading.Thread(target=self.load_cameras, args=loader_args, daemon=True).start()
+            self.wait_for_cameras(args.stream_min_views)
+        else:
+            self.load_cameras(*loader_args)
 
         if self.loaded_iter:
             self.gaussians.load_ply(os.path.join(self.model_path,
@@ -82,12 +122,51 @@ class Scene:
         else:
             self.gaussians.create_from_pcd(scene_info.point_cloud, self.cameras_extent)
 
-    def save(self, iteration):
+    def load_cameras(self, scene_info, resolution_scales, args, disk_cache):
+        try:
+            print("Loading Training Cameras")
+            cameraLists_from_camInfos(scene_info.train_cameras, resolution_scales, args, self.image_cache, disk_cache,
+                                      self.train_cameras, self.on_loaded, self.image_store)
+            print("Loading Test Cameras")
+            cameraLists_from_camInfos(scene_info.test_cameras, resolution_scales, args, self.image_cache, disk_cache,
+                                      self.test_cameras, image_store=self.image_store)
+
+            if disk_cache is not None:
+                disk_cache.evict()
+        except Exception as e:
+            self.loading_error = e
+            raise
+        finally:
+            with self.loading_condition:
+                self.loading_done = True
+                self.loading_condition.notify_all()
+
+    def on_loaded(self, count):
+        with self.loading_condition:
+            self.loaded_views = count
+            self.loading_condition.notify_all()
+
+    def wait_for_cameras(self, min_views=None):
+        """Block until min_views training views (all cameras if None) are loaded."""
+        with self.loading_condition:
+            self.loading_condition.wait_for(lambda: self.loading_done or
+                                            (min_views is not None and self.loaded_views >= min_views))
+        self.check_loading_error()
+
+    def check_loading_error(self):
+        """Re-raise a failure of the background camera loader."""
+        if self.loading_error is not None:
+            raise RuntimeError("Loading cameras failed") from self.loading_error
+
+    def save(self, iteration, writer=None):
         point_cloud_path = os.path.join(self.model_path, "point_cloud/iteration_{}".format(iteration))
-        self.gaussians.save_ply(os.path.join(point_cloud_path, "point_cloud.ply"))
+        self.gaussians.save_ply(os.path.join(point_cloud_path, "point_cloud.ply"), writer)
 
     def getTrainCameras(self, scale=1.0):
+        """Training cameras loaded so far, see stream."""
+        self.check_loading_error()
         return self.train_cameras[scale]
 
     def getTestCameras(self, scale=1.0):
+        self.wait_for_cameras()
         return self.test_cameras[scale]
\ No newline at end of file
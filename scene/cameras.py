@@ -12,12 +12,52 @@
 import torch
 from torch import nn
 import numpy as np
-from utils.graphics_utils import getWorld2View2, getProjectionMatrix
+from utils.graphics_utils import getWorld2View2Batch, getProjectionMatrixBatch
+
+class CameraBatch:
+    """
+    Poses and intrinsics of many cameras as stacked tensors. All matrices are
+    built with batched ops on the host and moved to device in one transfer
+    (None keeps them on the host), camera centers come from a single batched
+    inverse there. Camera objects are views into a batch (see Camera.batch
+    and Camera.batch_index).
+    """
+
+    def __init__(self, R, T, FoVx, FoVy, trans=np.array([0.0, 0.0, 0.0]), scale=1.0,
+                 znear=0.01, zfar=100.0, device=None):
+        self.R = np.asarray(R)
+        self.T = np.asarray(T)
+        self.FoVx = np.asarray(FoVx, dtype=np.float64)
+        self.FoVy = np.asarray(FoVy, dtype=np.float64)
+        self.znear = znear
+        self.zfar = zfar
+        self.trans = trans
+        self.scale = scale
+
+        world_view = torch.from_numpy(getWorld2View2Batch(self.R, self.T, trans, scale)).transpose(1, 2)
+        projection = getProjectionMatrixBatch(znear, zfar, self.FoVx, self.FoVy).transpose(1, 2)
+        matrices = torch.stack((world_view, projection), dim=1)
+        if device is not None:
+            matrices = matrices.to(device)
+
+        self.world_view_transforms = matrices[:, 0]
+        self.projection_matrices = matrices[:, 1]
+        self.full_proj_transforms = self.world_view_transforms.bmm(self.projection_matrices)
+        self.camera_centers = torch.linalg.inv(self.world_view_transforms)[:, 3, :3]
+
+    @classmethod
+    def from_cam_infos(cls, cam_infos, device=None):
+        return cls(np.stack([c.R for c in cam_infos]), np.stack([c.T for c in cam_infos]),
+                   [c.FovX for c in cam_infos], [c.FovY for c in cam_infos], device=device)
+
+    def __len__(self):
+        return len(self.FoVx)
 
 class Camera(nn.Module):
     def __init__(self, colmap_id, R, T, FoVx, FoVy, image, gt_alpha_mask,
                  image_name, uid,
-                 trans=np.array([0.0, 0.0, 0.0]), scale=1.0, data_device = "cuda"
+                 trans=np.array([0.0, 0.0, 0.0]), scale=1.0, data_device = "cuda",
+                 image_loader=None, image_cache=None, resolution=None, batch=None, batch_index=0, device=None
                  ):
         super(Camera, self).__init__()
 
@@ -32,29 +72,97 @@ class Camera(nn.Module):
         try:
             self.data_device = torch.device(data_device)
         except Exception as e:
+            fallback = "cuda" if device is None else device
             print(e)
-            print(f"[Warning] Custom device {data_device} failed, fallback to default cuda device" )
-            self.data_device = torch.device("cuda")
+            print(f"[Warning] Custom device {data_device} failed, fallback to device {fallback}" )
+            self.data_device = torch.device(fallback)
+
+        # Lazy mode: image_loader returns (image, gt_alpha_mask) on demand, the
+        # prepared image is kept in image_cache (if any) and resolution is (width, height).
+        self.image_loader = image_loader
+        self.image_cache = image_cache
+        if image_loader is None:
+            self._stored_image = self.prepare_image(image, gt_alpha_mask)
+            self.image_width = self._stored_image.shape[2]
+            self.image_height = self._stored_image.shape[1]
+        else:
+            self._stored_image = None
+            self.image_width, self.image_height = resolution
 
-        self.original_image = image.clamp(0.0, 1.0).to(self.data_device)
-        self.image_width = self.original_image.shape[2]
-        self.image_height = self.original_image.shape[1]
+        self.trans = trans
+        self.scale = scale
+
+        # Pose and projection are views into a CameraBatch, shared by all
+        # cameras of the same view (e.g. one per resolution scale).
+        if batch is None:
+            # Without an explicit device the pose lives next to the image
+            batch = CameraBatch(R[None], T[None], [FoVx], [FoVy], trans, scale,
+                                device=self.data_device if device is None else device)
+            batch_index = 0
+        self.batch = batch
+        self.batch_index = batch_index
+
+        self.zfar = batch.zfar
+        self.znear = batch.znear
+
+        self.world_view_transform = batch.world_view_transforms[batch_index]
+        self.projection_matrix = batch.projection_matrices[batch_index]
+        self.full_proj_transform = batch.full_proj_transforms[batch_index]
+        self.camera_center = batch.camera_centers[batch_index]
+
+    def prepare_image(self, image, gt_alpha_mask):
+        if image.dtype == torch.uint8:
+            # Compact storage: uint8 RGB plus the alpha mask as optional 4th
+            # channel, normalized and premultiplied only in fetch_image.
+            if gt_alpha_mask is not None:
+                image = torch.cat((image, gt_alpha_mask), dim=0)
+            return image.to(self.data_device)
 
+        original_image = image.clamp(0.0, 1.0).to(self.data_device)
         if gt_alpha_mask is not None:
-            self.original_image *= gt_alpha_mask.to(self.data_device)
+            original_image *= gt_alpha_mask.to(self.data_device)
         else:
-            self.original_image *= torch.ones((1, self.image_height, self.image_width), device=self.data_device)
+            original_image *= torch.ones((1, original_image.shape[1], original_image.shape[2]), device=self.data_device)
+        return original_image
 
-        self.zfar = 100.0
-        self.znear = 0.01
+    def load_image(self):
+        return self.prepare_image(*self.image_loader())
 
-        self.trans = trans
-        self.scale = scale
+    @property
+    def image_key(self):
+        return (self.image_name, self.image_width, self.image_height)
+
+    def stored_image(self):
+        """Image as stored on data_device, uint8 for compact cameras."""
+        if self.image_loader is None:
+            return self._stored_image
+        if self.image_cache is None:
+            return self.load_image()
+        return self.image_cache.get(self.image_key, self.load_image)
+
+    @staticmethod
+    def normalize_image(image):
+        if image.dtype != torch.uint8:
+            return image
+        original_image = image[:3] / 255.0
+        if image.shape[0] == 4:
+            original_image *= image[3:4] / 255.0
+        return original_image
+
+    def fetch_image(self, device=None):
+        """Ground truth image as normalized float, moved to device first if given."""
+        image = self.stored_image()
+        if device is not None:
+            image = image.to(device)
+        return self.normalize_image(image)
+
+    @property
+    def original_image(self):
+        return self.fetch_image()
 
-        self.world_view_transform = torch.tensor(getWorld2View2(R, T, trans, scale)).transpose(0, 1).cuda()
-        self.projection_matrix = getProjectionMatrix(znear=self.znear, zfar=self.zfar, fovX=self.FoVx, fovY=self.FoVy).transpose(0,1).cuda()
-        self.full_proj_transform = (self.world_view_transform.unsqueeze(0).bmm(self.projection_matrix.unsqueeze(0))).squeeze(0)
-        self.camera_center = self.world_view_transform.inverse()[3, :3]
+    def prefetch_image(self):
+        if self.image_cache is not None:
+            self.image_cache.prefetch(self.image_key, self.load_image)
 
 class MiniCam:
     def __init__(self, width, height, fovy, fovx, znear, zfar, world_view_transform, full_proj_transform):
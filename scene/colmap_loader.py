@@ -12,6 +12,8 @@
 import numpy as np
 import collections
 import struct
+import mmap
+import itertools
 
 CameraModel = collections.namedtuple(
     "CameraModel", ["model_id", "model_name", "num_params"])
@@ -38,6 +40,13 @@ CAMERA_MODEL_IDS = dict([(camera_model.model_id, camera_model)
                          for camera_model in CAMERA_MODELS])
 CAMERA_MODEL_NAMES = dict([(camera_model.model_name, camera_model)
                            for camera_model in CAMERA_MODELS])
+POINT3D_BINARY_DTYPE = np.dtype([
+    ("id", "<u8"), ("xyz", "<f8", 3), ("rgb", "u1", 3),
+    ("error", "<f8"), ("track_length", "<u8")])
+TRACK_ELEM_BINARY_DTYPE = np.dtype([("image_id", "<i4"), ("point2D_idx", "<i4")])
+IMAGE_BINARY_DTYPE = np.dtype([
+    ("id", "<i4"), ("qvec", "<f8", 4), ("tvec", "<f8", 3), ("camera_id", "<i4")])
+POINT2D_BINARY_DTYPE = np.dtype([("xy", "<f8", 2), ("point3D_id", "<i8")])
 
 
 def qvec2rotmat(qvec):
@@ -80,101 +89,130 @@ def read_next_bytes(fid, num_bytes, format_char_sequence, endian_character="<"):
     data = fid.read(num_bytes)
     return struct.unpack(endian_character + format_char_sequence, data)
 
-def read_points3D_text(path):
-    """
-    see: src/base/reconstruction.cc
-        void Reconstruction::ReadPoints3DText(const std::string& path)
-        void Reconstruction::WritePoints3DText(const std::string& path)
+def read_text_chunks(path, chunk_size=1 << 22, skip_empty=True):
+    """Read a COLMAP text file in a single pass, yielding lists of stripped lines
+    covering roughly chunk_size characters each. Comment lines are always
+    dropped, empty lines only if skip_empty is set.
     """
-    xyzs = None
-    rgbs = None
-    errors = None
-    num_points = 0
     with open(path, "r") as fid:
         while True:
-            line = fid.readline()
-            if not line:
+            lines = fid.readlines(chunk_size)
+            if not lines:
                 break
-            line = line.strip()
-            if len(line) > 0 and line[0] != "#":
-                num_points += 1
+            chunk = []
+            for line in lines:
+                line = line.strip()
+                if len(line) > 0 and line[0] == "#":
+                    continue
+                if len(line) > 0 or not skip_empty:
+                    chunk.append(line)
+            yield chunk
 
+def grow_rows(array, min_rows):
+    """Geometrically grow the first dimension of array to hold at least min_rows."""
+    if array.shape[0] >= min_rows:
+        return array
+    grown = np.empty((max(min_rows, 2 * array.shape[0]),) + array.shape[1:], dtype=array.dtype)
+    grown[:array.shape[0]] = array
+    return grown
+
+def read_points3D_text(path):
+    """
+    see: src/base/reconstruction.cc
+        void Reconstruction::ReadPoints3DText(const std::string& path)
+        void Reconstruction::WritePoints3DText(const std::string& path)
 
-    xyzs = np.empty((num_points, 3))
-    rgbs = np.empty((num_points, 3))
-    errors = np.empty((num_points, 1))
+    The file is read once in chunks, the leading numeric columns of every
+    chunk are parsed as one block and appended to geometrically grown buffers.
+    """
+    columns = np.empty((1 << 10, 7))
     count = 0
-    with open(path, "r") as fid:
-        while True:
-            line = fid.readline()
-            if not line:
-                break
-            line = line.strip()
-            if len(line) > 0 and line[0] != "#":
-                elems = line.split()
-                xyz = np.array(tuple(map(float, elems[1:4])))
-                rgb = np.array(tuple(map(int, elems[4:7])))
-                error = np.array(float(elems[7]))
-                xyzs[count] = xyz
-                rgbs[count] = rgb
-                errors[count] = error
-                count += 1
+    for lines in read_text_chunks(path):
+        # Only ID X Y Z R G B ERROR are needed, the track is left unsplit.
+        block = np.fromiter(itertools.chain.from_iterable(line.split(None, 8)[1:8] for line in lines),
+                            dtype=np.float64, count=7 * len(lines)).reshape(-1, 7)
+        columns = grow_rows(columns, count + block.shape[0])
+        columns[count:count + block.shape[0]] = block
+        count += block.shape[0]
 
+    xyzs = columns[:count, 0:3].copy()
+    rgbs = columns[:count, 3:6].copy()
+    errors = columns[:count, 6:7].copy()
     return xyzs, rgbs, errors
 
-def read_points3D_binary(path_to_model_file):
+def gather_records(data, starts, record_size, chunk_size=1 << 16):
+    """Copy fixed-size records found at arbitrary byte offsets into one contiguous buffer.
+    :param data: 1D uint8 array (typically a np.memmap of the model file).
+    :param starts: 1D int64 array of byte offsets, one per record.
+    :param record_size: Size of each record in bytes.
+    :return: uint8 array of shape (len(starts), record_size).
+    """
+    out = np.empty((len(starts), record_size), dtype=np.uint8)
+    columns = np.arange(record_size, dtype=np.int64)
+    for begin in range(0, len(starts), chunk_size):
+        end = begin + chunk_size
+        out[begin:end] = data[starts[begin:end, None] + columns]
+    return out
+
+def read_points3D_binary(path_to_model_file, return_tracks=False):
     """
     see: src/base/reconstruction.cc
         void Reconstruction::ReadPoints3DBinary(const std::string& path)
         void Reconstruction::WritePoints3DBinary(const std::string& path)
+
+    The file is memory-mapped and scanned once to locate the variable-length
+    track records, the fixed-size point headers are then pulled out in bulk.
+    :param return_tracks: Additionally return the tracks as CSR-style arrays
+        (track_ptr, image_ids, point2D_idxs), where the track of point i is
+        image_ids[track_ptr[i]:track_ptr[i+1]].
     """
+    data = np.memmap(path_to_model_file, dtype=np.uint8, mode="r")
+    num_points = int(data[:8].view("<u8")[0])
+    header_size = POINT3D_BINARY_DTYPE.itemsize
+    elem_size = TRACK_ELEM_BINARY_DTYPE.itemsize
 
+    # Single scan over the track lengths to find where every record starts.
+    buffer = memoryview(data)
+    unpack_track_length = struct.Struct("<Q").unpack_from
+    starts = np.empty(num_points, dtype=np.int64)
+    offset = 8
+    for p_id in range(num_points):
+        starts[p_id] = offset
+        offset += header_size + elem_size * unpack_track_length(buffer, offset + header_size - 8)[0]
 
-    with open(path_to_model_file, "rb") as fid:
-        num_points = read_next_bytes(fid, 8, "Q")[0]
-
-        xyzs = np.empty((num_points, 3))
-        rgbs = np.empty((num_points, 3))
-        errors = np.empty((num_points, 1))
-
-        for p_id in range(num_points):
-            binary_point_line_properties = read_next_bytes(
-                fid, num_bytes=43, format_char_sequence="QdddBBBd")
-            xyz = np.array(binary_point_line_properties[1:4])
-            rgb = np.array(binary_point_line_properties[4:7])
-            error = np.array(binary_point_line_properties[7])
-            track_length = read_next_bytes(
-                fid, num_bytes=8, format_char_sequence="Q")[0]
-            track_elems = read_next_bytes(
-                fid, num_bytes=8*track_length,
-                format_char_sequence="ii"*track_length)
-            xyzs[p_id] = xyz
-            rgbs[p_id] = rgb
-            errors[p_id] = error
-    return xyzs, rgbs, errors
+    headers = gather_records(data, starts, header_size).view(POINT3D_BINARY_DTYPE).ravel()
+    xyzs = headers["xyz"].astype(np.float64)
+    rgbs = headers["rgb"].astype(np.float64)
+    errors = headers["error"].astype(np.float64)[:, None]
+    if not return_tracks:
+        return xyzs, rgbs, errors
+
+    track_lengths = headers["track_length"].astype(np.int64)
+    track_ptr = np.zeros(num_points + 1, dtype=np.int64)
+    np.cumsum(track_lengths, out=track_ptr[1:])
+    elem_starts = np.repeat(starts + header_size - track_ptr[:-1] * elem_size, track_lengths) \
+        + np.arange(track_ptr[-1], dtype=np.int64) * elem_size
+    track_elems = gather_records(data, elem_starts, elem_size).view(TRACK_ELEM_BINARY_DTYPE).ravel()
+    tracks = (track_ptr, track_elems["image_id"].copy(), track_elems["point2D_idx"].copy())
+    return xyzs, rgbs, errors, tracks
 
 def read_intrinsics_text(path):
     """
     Taken from https://github.com/colmap/colmap/blob/dev/scripts/python/read_write_model.py
     """
     cameras = {}
-    with open(path, "r") as fid:
-        while True:
-            line = fid.readline()
-            if not line:
-                break
-            line = line.strip()
-            if len(line) > 0 and line[0] != "#":
-                elems = line.split()
-                camera_id = int(elems[0])
-                model = elems[1]
-                assert model == "PINHOLE", "While the loader support other types, the rest of the code assumes PINHOLE"
-                width = int(elems[2])
-                height = int(elems[3])
-                params = np.array(tuple(map(float, elems[4:])))
-                cameras[camera_id] = Camera(id=camera_id, model=model,
-                                            width=width, height=height,
-                                            params=params)
+    for lines in read_text_chunks(path):
+        for line in lines:
+            elems = line.split()
+            camera_id = int(elems[0])
+            model = elems[1]
+            assert model == "PINHOLE", "While the loader support other types, the rest of the code assumes PINHOLE"
+            width = int(elems[2])
+            height = int(elems[3])
+            params = np.array(elems[4:], dtype=str).astype(np.float64)
+            cameras[camera_id] = Camera(id=camera_id, model=model,
+                                        width=width, height=height,
+                                        params=params)
     return cameras
 
 def read_extrinsics_binary(path_to_model_file):
@@ -182,33 +220,47 @@ def read_extrinsics_binary(path_to_model_file):
     see: src/base/reconstruction.cc
         void Reconstruction::ReadImagesBinary(const std::string& path)
         void Reconstruction::WriteImagesBinary(const std::string& path)
+
+    The file is memory-mapped, the fixed-size image headers are parsed in bulk
+    and the 2D observations (xys, point3D_ids) are returned as zero-copy views
+    into the mapping, so they are only paged in when actually accessed.
     """
-    images = {}
     with open(path_to_model_file, "rb") as fid:
-        num_reg_images = read_next_bytes(fid, 8, "Q")[0]
-        for _ in range(num_reg_images):
-            binary_image_properties = read_next_bytes(
-                fid, num_bytes=64, format_char_sequence="idddddddi")
-            image_id = binary_image_properties[0]
-            qvec = np.array(binary_image_properties[1:5])
-            tvec = np.array(binary_image_properties[5:8])
-            camera_id = binary_image_properties[8]
-            image_name = ""
-            current_char = read_next_bytes(fid, 1, "c")[0]
-            while current_char != b"\x00":   # look for the ASCII 0 entry
-                image_name += current_char.decode("utf-8")
-                current_char = read_next_bytes(fid, 1, "c")[0]
-            num_points2D = read_next_bytes(fid, num_bytes=8,
-                                           format_char_sequence="Q")[0]
-            x_y_id_s = read_next_bytes(fid, num_bytes=24*num_points2D,
-                                       format_char_sequence="ddq"*num_points2D)
-            xys = np.column_stack([tuple(map(float, x_y_id_s[0::3])),
-                                   tuple(map(float, x_y_id_s[1::3]))])
-            point3D_ids = np.array(tuple(map(int, x_y_id_s[2::3])))
-            images[image_id] = Image(
-                id=image_id, qvec=qvec, tvec=tvec,
-                camera_id=camera_id, name=image_name,
-                xys=xys, point3D_ids=point3D_ids)
+        data = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+    num_reg_images = struct.unpack_from("<Q", data, 0)[0]
+    header_size = IMAGE_BINARY_DTYPE.itemsize
+    point2D_size = POINT2D_BINARY_DTYPE.itemsize
+
+    # Single scan locating the variable-length name and observation blocks.
+    unpack_num_points2D = struct.Struct("<Q").unpack_from
+    starts = np.empty(num_reg_images, dtype=np.int64)
+    name_ends = []
+    num_points2D = []
+    offset = 8
+    for idx in range(num_reg_images):
+        starts[idx] = offset
+        name_end = data.find(b"\x00", offset + header_size)   # look for the ASCII 0 entry
+        count = unpack_num_points2D(data, name_end + 1)[0]
+        name_ends.append(name_end)
+        num_points2D.append(count)
+        offset = name_end + 9 + point2D_size * count
+
+    headers = gather_records(np.frombuffer(data, dtype=np.uint8), starts, header_size)
+    headers = headers.view(IMAGE_BINARY_DTYPE).ravel()
+    image_ids = headers["id"].tolist()
+    camera_ids = headers["camera_id"].tolist()
+
+    images = {}
+    for idx, image_id in enumerate(image_ids):
+        start = int(starts[idx])
+        name_end = name_ends[idx]
+        points2D = np.frombuffer(data, dtype=POINT2D_BINARY_DTYPE,
+                                 count=num_points2D[idx], offset=name_end + 9)
+        images[image_id] = Image(
+            id=image_id, qvec=headers["qvec"][idx], tvec=headers["tvec"][idx],
+            camera_id=camera_ids[idx],
+            name=data[start + header_size:name_end].decode("utf-8"),
+            xys=points2D["xy"], point3D_ids=points2D["point3D_id"])
     return images
 
 
@@ -241,32 +293,41 @@ def read_intrinsics_binary(path_to_model_file):
     return cameras
 
 
+def parse_image_text_records(records, images):
+    """Parse (header elems, observation line) pairs of images.txt into images."""
+    if not records:
+        return
+    numeric = np.fromiter(itertools.chain.from_iterable(elems[:9] for elems, _ in records),
+                          dtype=np.float64, count=9 * len(records)).reshape(-1, 9)
+    image_ids = numeric[:, 0].astype(np.int64).tolist()
+    camera_ids = numeric[:, 8].astype(np.int64).tolist()
+    for idx, (elems, observations) in enumerate(records):
+        points2D = np.fromstring(observations, sep=" ").reshape(-1, 3)
+        images[image_ids[idx]] = Image(
+            id=image_ids[idx], qvec=numeric[idx, 1:5], tvec=numeric[idx, 5:8],
+            camera_id=camera_ids[idx], name=elems[9],
+            xys=points2D[:, :2], point3D_ids=points2D[:, 2].astype(np.int64))
+
 def read_extrinsics_text(path):
     """
     Taken from https://github.com/colmap/colmap/blob/dev/scripts/python/read_write_model.py
+
+    Image header lines are parsed per chunk as one numeric block, the 2D
+    observation line following each header is parsed with np.fromstring.
     """
     images = {}
-    with open(path, "r") as fid:
-        while True:
-            line = fid.readline()
-            if not line:
-                break
-            line = line.strip()
-            if len(line) > 0 and line[0] != "#":
-                elems = line.split()
-                image_id = int(elems[0])
-                qvec = np.array(tuple(map(float, elems[1:5])))
-                tvec = np.array(tuple(map(float, elems[5:8])))
-                camera_id = int(elems[8])
-                image_name = elems[9]
-                elems = fid.readline().split()
-                xys = np.column_stack([tuple(map(float, elems[0::3])),
-                                       tuple(map(float, elems[1::3]))])
-                point3D_ids = np.array(tuple(map(int, elems[2::3])))
-                images[image_id] = Image(
-                    id=image_id, qvec=qvec, tvec=tvec,
-                    camera_id=camera_id, name=image_name,
-                    xys=xys, point3D_ids=point3D_ids)
+    header = None
+    for lines in read_text_chunks(path, skip_empty=False):
+        records = []
+        for line in lines:
+            if header is not None:
+                records.append((header, line))
+                header = None
+            elif len(line) > 0:
+                header = line.split()
+        parse_image_text_records(records, images)
+    if header is not None:
+        parse_image_text_records([(header, "")], images)
     return images
 
 
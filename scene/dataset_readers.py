@@ -10,12 +10,13 @@
 #
 
 import os
-import sys
 from PIL import Image
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
 from typing import NamedTuple
 from scene.colmap_loader import read_extrinsics_text, read_intrinsics_text, qvec2rotmat, \
     read_extrinsics_binary, read_intrinsics_binary, read_points3D_binary, read_points3D_text
-from utils.graphics_utils import getWorld2View2, focal2fov, fov2focal
+from utils.graphics_utils import getWorld2View2Batch, focal2fov, fov2focal
 import numpy as np
 import json
 from pathlib import Path
@@ -41,6 +42,7 @@ class SceneInfo(NamedTuple):
     test_cameras: list
     nerf_normalization: dict
     ply_path: str
+    source_files: tuple = ()
 
 def getNerfppNorm(cam_info):
     def get_center_and_diag(cam_centers):
@@ -51,12 +53,9 @@ def getNerfppNorm(cam_info):
         diagonal = np.max(dist)
         return center.flatten(), diagonal
 
-    cam_centers = []
-
-    for cam in cam_info:
-        W2C = getWorld2View2(cam.R, cam.T)
-        C2W = np.linalg.inv(W2C)
-        cam_centers.append(C2W[:3, 3:4])
+    W2C = getWorld2View2Batch(np.stack([cam.R for cam in cam_info]), np.stack([cam.T for cam in cam_info]))
+    C2W = np.linalg.inv(W2C)
+    cam_centers = C2W[:, :3, 3:4]
 
     center, diagonal = get_center_and_diag(cam_centers)
     radius = diagonal * 1.1
@@ -67,12 +66,7 @@ def getNerfppNorm(cam_info):
 
 def readColmapCameras(cam_extrinsics, cam_intrinsics, images_folder):
     cam_infos = []
-    for idx, key in enumerate(cam_extrinsics):
-        sys.stdout.write('\r')
-        # the exact output you're looking for:
-        sys.stdout.write("Reading camera {}/{}".format(idx+1, len(cam_extrinsics)))
-        sys.stdout.flush()
-
+    for idx, key in enumerate(tqdm(cam_extrinsics, desc="Reading cameras")):
         extr = cam_extrinsics[key]
         intr = cam_intrinsics[extr.camera_id]
         height = intr.height
@@ -101,7 +95,6 @@ def readColmapCameras(cam_extrinsics, cam_intrinsics, images_folder):
         cam_info = CameraInfo(uid=uid, R=R, T=T, FovY=FovY, FovX=FovX, image=image,
                               image_path=image_path, image_name=image_name, width=width, height=height)
         cam_infos.append(cam_info)
-    sys.stdout.write('\n')
     return cam_infos
 
 def fetchPly(path):
@@ -118,11 +111,12 @@ def storePly(path, xyz, rgb):
             ('nx', 'f4'), ('ny', 'f4'), ('nz', 'f4'),
             ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
     
-    normals = np.zeros_like(xyz)
-
-    elements = np.empty(xyz.shape[0], dtype=dtype)
-    attributes = np.concatenate((xyz, normals, rgb), axis=1)
-    elements[:] = list(map(tuple, attributes))
+    # Fill the structured array column by column instead of through per-vertex tuples
+    elements = np.zeros(xyz.shape[0], dtype=dtype)
+    for idx, name in enumerate(['x', 'y', 'z']):
+        elements[name] = xyz[:, idx]
+    for idx, name in enumerate(['red', 'green', 'blue']):
+        elements[name] = rgb[:, idx]
 
     # Create the PlyData object and write to file
     vertex_element = PlyElement.describe(elements, 'vertex')
@@ -173,10 +167,44 @@ def readColmapSceneInfo(path, images, eval, llffhold=8):
                            train_cameras=train_cam_infos,
                            test_cameras=test_cam_infos,
                            nerf_normalization=nerf_normalization,
-                           ply_path=ply_path)
+                           ply_path=ply_path,
+                           source_files=(cameras_extrinsic_file, cameras_intrinsic_file))
     return scene_info
 
-def readCamerasFromTransforms(path, transformsfile, white_background, extension=".png"):
+def compositeLUT(white_background):
+    """
+    Lookup table mapping (channel << 8 | alpha) of 8-bit RGBA to the 8-bit RGB
+    composited over the background, evaluated once with the float formula the
+    per-pixel compositing used, so results are bit-identical to it.
+    """
+    bg = 1 if white_background else 0
+    channel, alpha = np.meshgrid(np.arange(256) / 255.0, np.arange(256) / 255.0, indexing="ij")
+    arr = channel * alpha + bg * (1 - alpha)
+    return np.array(arr*255.0, dtype=np.byte).view(np.uint8).ravel()
+
+def readCompositedImage(image_path, lut):
+    with Image.open(image_path) as image:
+        im_data = np.array(image.convert("RGBA"))
+    index = im_data[:, :, :3].astype(np.uint16) << 8
+    index |= im_data[:, :, 3:4]
+    return lut[index]
+
+class DeferredImage:
+    """
+    Image that is only decoded by load(), to an HxWxC uint8 array. Size and
+    mode are known without decoding it (e.g. from the scene index).
+    """
+
+    def __init__(self, image_path, size, mode, decode):
+        self.image_path = image_path
+        self.size = size
+        self.mode = mode
+        self.decode = decode
+
+    def load(self):
+        return self.decode(self.image_path)
+
+def readCamerasFromTransforms(path, transformsfile, white_background, extension=".png", num_workers=8):
     cam_infos = []
 
     with open(os.path.join(path, transformsfile)) as json_file:
@@ -184,45 +212,42 @@ def readCamerasFromTransforms(path, transformsfile, white_background, extension=
         fovx = contents["camera_angle_x"]
 
         frames = contents["frames"]
-        for idx, frame in enumerate(frames):
-            cam_name = os.path.join(path, frame["file_path"] + extension)
-
-            # NeRF 'transform_matrix' is a camera-to-world transform
-            c2w = np.array(frame["transform_matrix"])
-            # change from OpenGL/Blender camera axes (Y up, Z back) to COLMAP (Y down, Z forward)
-            c2w[:3, 1:3] *= -1
-
-            # get the world-to-camera transform and set R, T
-            w2c = np.linalg.inv(c2w)
-            R = np.transpose(w2c[:3,:3])  # R is stored transposed due to 'glm' in CUDA code
-            T = w2c[:3, 3]
-
-            image_path = os.path.join(path, cam_name)
-            image_name = Path(cam_name).stem
-            image = Image.open(image_path)
-
-            im_data = np.array(image.convert("RGBA"))
-
-            bg = np.array([1,1,1]) if white_background else np.array([0, 0, 0])
-
-            norm_data = im_data / 255.0
-            arr = norm_data[:,:,:3] * norm_data[:, :, 3:4] + bg * (1 - norm_data[:, :, 3:4])
-            image = Image.fromarray(np.array(arr*255.0, dtype=np.byte), "RGB")
-
-            fovy = focal2fov(fov2focal(fovx, image.size[0]), image.size[1])
-            FovY = fovy 
-            FovX = fovx
-
-            cam_infos.append(CameraInfo(uid=idx, R=R, T=T, FovY=FovY, FovX=FovX, image=image,
-                            image_path=image_path, image_name=image_name, width=image.size[0], height=image.size[1]))
+        image_paths = [os.path.join(path, frame["file_path"] + extension) for frame in frames]
+
+        # Decoding and alpha compositing run on a thread pool, the composited
+        # HxWx3 uint8 arrays are handed to camera construction as is.
+        lut = compositeLUT(white_background)
+        with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+            images = executor.map(lambda image_path: readCompositedImage(image_path, lut), image_paths)
+
+            for idx, (frame, image_path, image) in enumerate(zip(frames, image_paths, images)):
+                # NeRF 'transform_matrix' is a camera-to-world transform
+                c2w = np.array(frame["transform_matrix"])
+                # change from OpenGL/Blender camera axes (Y up, Z back) to COLMAP (Y down, Z forward)
+                c2w[:3, 1:3] *= -1
+
+                # get the world-to-camera transform and set R, T
+                w2c = np.linalg.inv(c2w)
+                R = np.transpose(w2c[:3,:3])  # R is stored transposed due to 'glm' in CUDA code
+                T = w2c[:3, 3]
+
+                image_name = Path(image_path).stem
+                height, width = image.shape[:2]
+
+                fovy = focal2fov(fov2focal(fovx, width), height)
+                FovY = fovy 
+                FovX = fovx
+
+                cam_infos.append(CameraInfo(uid=idx, R=R, T=T, FovY=FovY, FovX=FovX, image=image,
+                                image_path=image_path, image_name=image_name, width=width, height=height))
             
     return cam_infos
 
-def readNerfSyntheticInfo(path, white_background, eval, extension=".png"):
+def readNerfSyntheticInfo(path, white_background, eval, extension=".png", num_workers=8):
     print("Reading Training Transforms")
-    train_cam_infos = readCamerasFromTransforms(path, "transforms_train.json", white_background, extension)
+    train_cam_infos = readCamerasFromTransforms(path, "transforms_train.json", white_background, extension, num_workers)
     print("Reading Test Transforms")
-    test_cam_infos = readCamerasFromTransforms(path, "transforms_test.json", white_background, extension)
+    test_cam_infos = readCamerasFromTransforms(path, "transforms_test.json", white_background, extension, num_workers)
     
     if not eval:
         train_cam_infos.extend(test_cam_infos)
@@ -251,7 +276,9 @@ def readNerfSyntheticInfo(path, white_background, eval, extension=".png"):
                            train_cameras=train_cam_infos,
                            test_cameras=test_cam_infos,
                            nerf_normalization=nerf_normalization,
-                           ply_path=ply_path)
+                           ply_path=ply_path,
+                           source_files=(os.path.join(path, "transforms_train.json"),
+                                         os.path.join(path, "transforms_test.json")))
     return scene_info
 
 sceneLoadTypeCallbacks = {
@@ -0,0 +1,219 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import math
+import torch
+from torch import nn
+from scene.gaussian_model import GaussianModel
+from utils.general_utils import inverse_sigmoid, build_scaling_rotation, rotation_to_quaternion
+from utils.checkpoint_utils import write_tensor_file, read_tensor_file
+
+HIERARCHY_VERSION = 1
+
+def merge_nodes(groups, num_groups, xyz, cov, opacity, area, radius, features_dc, features_rest):
+    """
+    Moment-matched parents of the nodes, groups maps every node to its
+    parent. Children are weighted by opacity times footprint area; the
+    parent's opacity spreads the children's coverage over its own
+    footprint, capped by their alpha blended opacity.
+    """
+    def group_sum(values):
+        return torch.zeros((num_groups,) + values.shape[1:], dtype=values.dtype).index_add_(0, groups, values)
+
+    weight = opacity * area
+    total = group_sum(weight)
+    new_xyz = group_sum(weight[:, None] * xyz) / total[:, None]
+    offset = xyz - new_xyz[groups]
+    new_cov = group_sum(weight[:, None, None] * (cov + offset[:, :, None] * offset[:, None, :])) / total[:, None, None]
+    new_features_dc = group_sum(weight[:, None, None] * features_dc) / total[:, None, None]
+    new_features_rest = group_sum(weight[:, None, None] * features_rest) / total[:, None, None]
+
+    eigenvalues, eigenvectors = torch.linalg.eigh(new_cov)
+    new_scaling = torch.sqrt(torch.clamp_min(eigenvalues, 1e-20))
+    # eigh may return a reflection, flip one axis to get a rotation
+    flip = torch.linalg.det(eigenvectors) < 0
+    eigenvectors[flip, :, 0] = -eigenvectors[flip, :, 0]
+    new_area = math.pi * new_scaling[:, 1] * new_scaling[:, 2]
+
+    blended = 1.0 - torch.exp(group_sum(torch.log(torch.clamp_min(1.0 - opacity, 1e-6))))
+    new_opacity = torch.clamp(torch.minimum(group_sum(opacity * area) / new_area, blended), 1e-4, 0.99)
+
+    # Bounding spheres nest, which keeps the cut selection consistent
+    new_radius = torch.zeros(num_groups, dtype=xyz.dtype).scatter_reduce(
+        0, groups, offset.norm(dim=1) + radius, "amax", include_self=False)
+    new_radius = torch.maximum(new_radius, 3.0 * new_scaling[:, 2])
+    return new_xyz, new_cov, new_scaling, eigenvectors, new_opacity, new_area, new_radius, new_features_dc, new_features_rest
+
+class GaussianHierarchy:
+    """
+    Level of detail tree over the Gaussians of a trained model. The first
+    num_leaves nodes are the original Gaussians, every other node merges its
+    children and parent holds the index of each node's parent (-1 at the
+    root). Nodes are stored with the raw parameters of GaussianModel.
+    """
+
+    def __init__(self, tensors, max_sh_degree):
+        self.xyz = tensors["xyz"]
+        self.features_dc = tensors["f_dc"]
+        self.features_rest = tensors["f_rest"]
+        self.scaling = tensors["scaling"]
+        self.rotation = tensors["rotation"]
+        self.opacity = tensors["opacity"]
+        self.radius = tensors["radius"]
+        self.parent = tensors["parent"]
+        self.is_leaf = tensors["is_leaf"]
+        self.max_sh_degree = max_sh_degree
+
+        # Nodes grouped by depth below their root, for top down passes
+        depth = torch.zeros(len(self.parent), dtype=torch.int64)
+        has_parent = self.parent >= 0
+        while True:
+            new_depth = torch.where(has_parent, depth[torch.clamp_min(self.parent, 0)] + 1, torch.zeros_like(depth))
+            if torch.equal(new_depth, depth):
+                break
+            depth = new_depth
+        self.levels = [torch.nonzero(depth == level).squeeze(1) for level in range(1, int(depth.max()) + 1)] if len(depth) else []
+
+    def __len__(self):
+        return self.xyz.shape[0]
+
+    @classmethod
+    def build(cls, gaussians : GaussianModel, leaves_per_cell=8):
+        """
+        Cluster the Gaussians bottom up on a grid whose cell size doubles
+        with every level, merging each cell with more than one node. Runs on
+        the CPU in double precision.
+        """
+        with torch.no_grad():
+            xyz = gaussians.get_xyz.detach().cpu().double()
+            scaling = gaussians.get_scaling.detach().cpu().double()
+            L = build_scaling_rotation(gaussians.get_scaling.detach().cpu(), gaussians.get_rotation.detach().cpu()).double()
+            cov = L @ L.transpose(1, 2)
+            opacity = gaussians.get_opacity.detach().cpu().double()[:, 0]
+            sorted_scaling = torch.sort(scaling, dim=1)[0]
+            area = math.pi * sorted_scaling[:, 1] * sorted_scaling[:, 2]
+            radius = 3.0 * sorted_scaling[:, 2]
+            features_dc = gaussians._features_dc.detach().cpu().double()
+            features_rest = gaussians._features_rest.detach().cpu().double()
+
+            num_leaves = xyz.shape[0]
+            nodes = {"xyz": [xyz], "scaling": [scaling], "rotation": [gaussians.get_rotation.detach().cpu().double()],
+                     "opacity": [opacity], "radius": [radius], "f_dc": [features_dc], "f_rest": [features_rest]}
+            links = []
+
+            origin = xyz.amin(dim=0)
+            extent = xyz.amax(dim=0) - origin
+            extent = torch.clamp_min(extent, max(extent.max().item(), 1e-6) * 1e-3)
+            cell_size = (torch.prod(extent).item() * leaves_per_cell / num_leaves) ** (1.0 / 3.0)
+            # Surfaces fill few cells of their bounding box, refine until the
+            # occupied cells hold leaves_per_cell leaves on average
+            while num_leaves > leaves_per_cell * len(torch.unique(torch.floor((xyz - origin) / cell_size).long(), dim=0)):
+                cell_size *= 0.5
+
+            # Nodes without a parent yet: their ids and merge attributes
+            frontier = torch.arange(num_leaves)
+            current = (xyz, cov, opacity, area, radius, features_dc, features_rest)
+            num_nodes = num_leaves
+            while len(frontier) > 1:
+                cells = torch.floor((current[0] - origin) / cell_size).long()
+                _, groups, counts = torch.unique(cells, dim=0, return_inverse=True, return_counts=True)
+                cell_size *= 2.0
+                merged = counts[groups] > 1
+                if not merged.any():
+                    continue
+
+                # One parent per cell with more than one node, numbered after all existing nodes
+                local_ids = torch.cumsum(counts > 1, 0) - 1
+                num_parents = int((counts > 1).sum())
+                children = merged.nonzero().squeeze(1)
+                groups = local_ids[groups[children]]
+                links.append((frontier[children], groups + num_nodes))
+                new_xyz, new_cov, new_scaling, new_rotation, new_opacity, new_area, new_radius, new_dc, new_rest = merge_nodes(
+                    groups, num_parents, *(value[children] for value in current))
+
+                for name, value in (("xyz", new_xyz), ("scaling", new_scaling), ("rotation", rotation_to_quaternion(new_rotation)),
+                                    ("opacity", new_opacity), ("radius", new_radius), ("f_dc", new_dc), ("f_rest", new_rest)):
+                    nodes[name].append(value)
+
+                kept = (~merged).nonzero().squeeze(1)
+                frontier = torch.cat((frontier[kept], torch.arange(num_nodes, num_nodes + num_parents)))
+                current = tuple(torch.cat((value[kept], new_value)) for value, new_value in zip(
+                    current, (new_xyz, new_cov, new_opacity, new_area, new_radius, new_dc, new_rest)))
+                num_nodes += num_parents
+
+            nodes = {name: torch.cat(values) for name, values in nodes.items()}
+            parent = torch.full((num_nodes,), -1, dtype=torch.int64)
+            for child_ids, parent_ids in links:
+                parent[child_ids] = parent_ids
+            is_leaf = torch.zeros(num_nodes, dtype=torch.bool)
+            is_leaf[:num_leaves] = True
+            tensors = {
+                "xyz": nodes["xyz"].float(),
+                "f_dc": nodes["f_dc"].float(),
+                "f_rest": nodes["f_rest"].float(),
+                "scaling": torch.log(nodes["scaling"]).float(),
+                "rotation": nodes["rotation"].float(),
+                "opacity": inverse_sigmoid(nodes["opacity"][:, None]).float(),
+                "radius": nodes["radius"].float(),
+                "parent": parent,
+                "is_leaf": is_leaf,
+            }
+            # Leaves keep their exact trained parameters
+            tensors["scaling"][:num_leaves] = gaussians._scaling.detach().cpu()
+            tensors["rotation"][:num_leaves] = gaussians._rotation.detach().cpu()
+            tensors["opacity"][:num_leaves] = gaussians._opacity.detach().cpu()
+            return cls(tensors, gaussians.max_sh_degree)
+
+    def save(self, path):
+        tensors = {"xyz": self.xyz, "f_dc": self.features_dc, "f_rest": self.features_rest,
+                   "scaling": self.scaling, "rotation": self.rotation, "opacity": self.opacity,
+                   "radius": self.radius, "parent": self.parent, "is_leaf": self.is_leaf}
+        write_tensor_file(path, tensors, {"version": HIERARCHY_VERSION, "max_sh_degree": self.max_sh_degree})
+
+    @classmethod
+    def load(cls, path):
+        tensors, meta = read_tensor_file(path)
+        if meta.get("version") != HIERARCHY_VERSION:
+            raise ValueError("Unsupported hierarchy version in {}".format(path))
+        return cls(tensors, meta["max_sh_degree"])
+
+    def cut(self, camera, threshold=1.0):
+        """
+        Indices of the coarsest nodes whose bounding sphere projects to at
+        most threshold pixels in camera, leaves where none does. Children
+        spheres lie inside their parent's, so a node's projected size never
+        exceeds its parent's and every leaf is covered by exactly one node.
+        Runs on the CPU, the hierarchy tensors stay there.
+        """
+        focal = max(camera.image_width / (2.0 * math.tan(camera.FoVx * 0.5)),
+                    camera.image_height / (2.0 * math.tan(camera.FoVy * 0.5)))
+        distance = (self.xyz - camera.camera_center.detach().cpu()[None]).norm(dim=1) - self.radius
+        size = torch.where(distance > 0, focal * self.radius / torch.clamp_min(distance, 1e-12), torch.full_like(distance, math.inf))
+        fine = (size <= threshold) | self.is_leaf
+        # Rounding may break the nesting slightly, children of fine nodes are fine
+        for ids in self.levels:
+            fine[ids] |= fine[self.parent[ids]]
+        parent_fine = torch.where(self.parent >= 0, fine[torch.clamp_min(self.parent, 0)], torch.zeros_like(fine))
+        return torch.nonzero(fine & ~parent_fine).squeeze(1)
+
+    def cut_model(self, ids, device="cuda"):
+        """GaussianModel of the nodes ids, for rendering."""
+        gaussians = GaussianModel(self.max_sh_degree, device)
+        def select(tensor):
+            return nn.Parameter(tensor[ids].to(device), requires_grad=False)
+        gaussians._xyz = select(self.xyz)
+        gaussians._features_dc = select(self.features_dc)
+        gaussians._features_rest = select(self.features_rest)
+        gaussians._scaling = select(self.scaling)
+        gaussians._rotation = select(self.rotation)
+        gaussians._opacity = select(self.opacity)
+        gaussians.active_sh_degree = self.max_sh_degree
+        return gaussians
@@ -15,11 +15,18 @@ from utils.general_utils import inverse_sigmoid, get_expon_lr_func, build_rotati
 from torch import nn
 import os
 from utils.system_utils import mkdir_p
-from plyfile import PlyData, PlyElement
 from utils.sh_utils import RGB2SH
-from simple_knn._C import distCUDA2
+try:
+    from simple_knn._C import distCUDA2
+    SIMPLE_KNN_FOUND = True
+except ImportError:
+    SIMPLE_KNN_FOUND = False
 from utils.graphics_utils import BasicPointCloud
-from utils.general_utils import strip_symmetric, build_scaling_rotation
+from utils.general_utils import strip_symmetric, build_scaling_rotation, knn_mean_dist2
+from utils.ply_utils import read_vertex_matrix, select_columns, write_ply_columns
+from utils.persistence_utils import snapshot_to_host, snapshot_tree
+from utils.checkpoint_utils import write_tensor_file, read_tensor_file, TORCH_DTYPES
+from scene.spatial_index import SpatialIndex
 
 class GaussianModel:
 
@@ -41,7 +48,8 @@ class GaussianModel:
         self.rotation_activation = torch.nn.functional.normalize
 
 
-    def __init__(self, sh_degree : int):
+    def __init__(self, sh_degree : int, device="cuda"):
+        self.device = torch.device(device)
         self.active_sh_degree = 0
         self.max_sh_degree = sh_degree  
         self._xyz = torch.empty(0)
@@ -56,6 +64,7 @@ class GaussianModel:
         self.optimizer = None
         self.percent_dense = 0
         self.spatial_lr_scale = 0
+        self.spatial_index = None
         self.setup_functions()
 
     def capture(self):
@@ -92,6 +101,86 @@ class GaussianModel:
         self.denom = denom
         self.optimizer.load_state_dict(opt_dict)
 
+    def save_capture(self, path, iteration, writer=None):
+        """
+        torch.save of (capture(), iteration), the .pth checkpoint format. With
+        a BackgroundWriter the state is copied to host memory first and the
+        file is written by its worker thread.
+        """
+        if writer is None:
+            torch.save((self.capture(), iteration), path)
+        else:
+            writer.submit(torch.save, (snapshot_tree(self.capture()), iteration), path)
+
+    def save_checkpoint(self, path, iteration, sh_dtype="float32", writer=None):
+        """
+        Write the state captured by capture() in the native checkpoint format
+        (see utils/checkpoint_utils.py). SH coefficients can be stored as
+        float16/bfloat16, they are cast back to float32 on load. With a
+        BackgroundWriter the file is written by its worker thread.
+        """
+        sh_torch_dtype = TORCH_DTYPES[sh_dtype]
+        tensors = {
+            "xyz": self._xyz,
+            "f_dc": self._features_dc.detach().to(sh_torch_dtype),
+            "f_rest": self._features_rest.detach().to(sh_torch_dtype),
+            "scaling": self._scaling,
+            "rotation": self._rotation,
+            "opacity": self._opacity,
+            "max_radii2D": self.max_radii2D,
+            "xyz_gradient_accum": self.xyz_gradient_accum,
+            "denom": self.denom,
+        }
+        opt_dict = self.optimizer.state_dict()
+        for param_idx, param_state in opt_dict["state"].items():
+            for key, value in param_state.items():
+                tensors["optimizer.{}.{}".format(param_idx, key)] = value
+        meta = {
+            "iteration": iteration,
+            "active_sh_degree": self.active_sh_degree,
+            "spatial_lr_scale": float(self.spatial_lr_scale),
+            "param_groups": opt_dict["param_groups"],
+        }
+        if writer is None:
+            write_tensor_file(path, tensors, meta)
+        else:
+            tensors = {name: snapshot_to_host(tensor) for name, tensor in tensors.items()}
+            writer.submit(write_tensor_file, path, tensors, meta)
+
+    def load_checkpoint(self, path, training_args=None):
+        """
+        Load a checkpoint written by save_checkpoint, returns its iteration.
+        With training_args the full training state is restored (see restore),
+        otherwise only the Gaussian parameters are read, for inference.
+        """
+        param_names = ("xyz", "f_dc", "f_rest", "scaling", "rotation", "opacity")
+        if training_args is None:
+            tensors, meta = read_tensor_file(path, names=lambda name: name in param_names)
+        else:
+            tensors, meta = read_tensor_file(path)
+
+        params = [nn.Parameter(tensors[name].to(self.device, torch.float).requires_grad_(True)) for name in param_names]
+        if training_args is None:
+            (self._xyz, self._features_dc, self._features_rest,
+             self._scaling, self._rotation, self._opacity) = params
+            self.active_sh_degree = meta["active_sh_degree"]
+            self.spatial_lr_scale = meta["spatial_lr_scale"]
+            return meta["iteration"]
+
+        opt_state = {}
+        for name, value in tensors.items():
+            if name.startswith("optimizer."):
+                _, param_idx, key = name.split(".", 2)
+                opt_state.setdefault(int(param_idx), {})[key] = value
+        opt_dict = {"state": opt_state, "param_groups": meta["param_groups"]}
+        model_args = (meta["active_sh_degree"], *params,
+                      tensors["max_radii2D"].to(self.device),
+                      tensors["xyz_gradient_accum"].to(self.device),
+                      tensors["denom"].to(self.device),
+                      opt_dict, meta["spatial_lr_scale"])
+        self.restore(model_args, training_args)
+        return meta["iteration"]
+
     @property
     def get_scaling(self):
         return self.scaling_activation(self._scaling)
@@ -117,26 +206,38 @@ class GaussianModel:
     def get_covariance(self, scaling_modifier = 1):
         return self.covariance_activation(self.get_scaling, scaling_modifier, self._rotation)
 
+    def visible_gaussians(self, cameras, scaling_modifier = 1.0):
+        """Indices of the Gaussians that may be visible in any of cameras, None for all of them."""
+        if self.spatial_index is None or len(self.spatial_index) != self._xyz.shape[0]:
+            self.spatial_index = SpatialIndex(self._xyz)
+        # The optimizer updates parameters in place, which bumps their version
+        state = (id(self._xyz), self._xyz._version, id(self._scaling), self._scaling._version)
+        return self.spatial_index.visible(cameras, self._xyz, self.get_scaling, scaling_modifier, state)
+
     def oneupSHdegree(self):
         if self.active_sh_degree < self.max_sh_degree:
             self.active_sh_degree += 1
 
     def create_from_pcd(self, pcd : BasicPointCloud, spatial_lr_scale : float):
         self.spatial_lr_scale = spatial_lr_scale
-        fused_point_cloud = torch.tensor(np.asarray(pcd.points)).float().cuda()
-        fused_color = RGB2SH(torch.tensor(np.asarray(pcd.colors)).float().cuda())
-        features = torch.zeros((fused_color.shape[0], 3, (self.max_sh_degree + 1) ** 2)).float().cuda()
+        fused_point_cloud = torch.tensor(np.asarray(pcd.points)).float().to(self.device)
+        fused_color = RGB2SH(torch.tensor(np.asarray(pcd.colors)).float().to(self.device))
+        features = torch.zeros((fused_color.shape[0], 3, (self.max_sh_degree + 1) ** 2)).float().to(self.device)
         features[:, :3, 0 ] = fused_color
         features[:, 3:, 1:] = 0.0
 
         print("Number of points at initialisation : ", fused_point_cloud.shape[0])
 
-        dist2 = torch.clamp_min(distCUDA2(torch.from_numpy(np.asarray(pcd.points)).float().cuda()), 0.0000001)
+        points = torch.from_numpy(np.asarray(pcd.points)).float().to(self.device)
+        if self.device.type == "cuda" and SIMPLE_KNN_FOUND:
+            dist2 = torch.clamp_min(distCUDA2(points), 0.0000001)
+        else:
+            dist2 = torch.clamp_min(knn_mean_dist2(points), 0.0000001)
         scales = torch.log(torch.sqrt(dist2))[...,None].repeat(1, 3)
-        rots = torch.zeros((fused_point_cloud.shape[0], 4), device="cuda")
+        rots = torch.zeros((fused_point_cloud.shape[0], 4), device=self.device)
         rots[:, 0] = 1
 
-        opacities = inverse_sigmoid(0.1 * torch.ones((fused_point_cloud.shape[0], 1), dtype=torch.float, device="cuda"))
+        opacities = inverse_sigmoid(0.1 * torch.ones((fused_point_cloud.shape[0], 1), dtype=torch.float, device=self.device))
 
         self._xyz = nn.Parameter(fused_point_cloud.requires_grad_(True))
         self._features_dc = nn.Parameter(features[:,:,0:1].transpose(1, 2).contiguous().requires_grad_(True))
@@ -144,12 +245,12 @@ class GaussianModel:
         self._scaling = nn.Parameter(scales.requires_grad_(True))
         self._rotation = nn.Parameter(rots.requires_grad_(True))
         self._opacity = nn.Parameter(opacities.requires_grad_(True))
-        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device="cuda")
+        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device=self.device)
 
     def training_setup(self, training_args):
         self.percent_dense = training_args.percent_dense
-        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
-        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
+        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device=self.device)
+        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device=self.device)
 
         l = [
             {'params': [self._xyz], 'lr': training_args.position_lr_init * self.spatial_lr_scale, "name": "xyz"},
@@ -188,24 +289,26 @@ class GaussianModel:
             l.append('rot_{}'.format(i))
         return l
 
-    def save_ply(self, path):
+    def save_ply(self, path, writer=None):
+        """
+        Write the Gaussians as a PLY. With a BackgroundWriter, the tensors are
+        only snapshotted to host memory here and the file is written by its
+        worker thread.
+        """
         mkdir_p(os.path.dirname(path))
 
-        xyz = self._xyz.detach().cpu().numpy()
-        normals = np.zeros_like(xyz)
-        f_dc = self._features_dc.detach().transpose(1, 2).flatten(start_dim=1).contiguous().cpu().numpy()
-        f_rest = self._features_rest.detach().transpose(1, 2).flatten(start_dim=1).contiguous().cpu().numpy()
-        opacities = self._opacity.detach().cpu().numpy()
-        scale = self._scaling.detach().cpu().numpy()
-        rotation = self._rotation.detach().cpu().numpy()
-
-        dtype_full = [(attribute, 'f4') for attribute in self.construct_list_of_attributes()]
+        f_dc = self._features_dc.detach().transpose(1, 2).flatten(start_dim=1)
+        f_rest = self._features_rest.detach().transpose(1, 2).flatten(start_dim=1)
+        # Normals (None) are written as zeros
+        columns = [self._xyz.detach(), None, f_dc, f_rest,
+                   self._opacity.detach(), self._scaling.detach(), self._rotation.detach()]
+        attribute_names = self.construct_list_of_attributes()
 
-        elements = np.empty(xyz.shape[0], dtype=dtype_full)
-        attributes = np.concatenate((xyz, normals, f_dc, f_rest, opacities, scale, rotation), axis=1)
-        elements[:] = list(map(tuple, attributes))
-        el = PlyElement.describe(elements, 'vertex')
-        PlyData([el]).write(path)
+        if writer is None:
+            write_ply_columns(path, columns, attribute_names)
+        else:
+            columns = [None if column is None else snapshot_to_host(column) for column in columns]
+            writer.submit(write_ply_columns, path, columns, attribute_names)
 
     def reset_opacity(self):
         opacities_new = inverse_sigmoid(torch.min(self.get_opacity, torch.ones_like(self.get_opacity)*0.01))
@@ -213,45 +316,31 @@ class GaussianModel:
         self._opacity = optimizable_tensors["opacity"]
 
     def load_ply(self, path):
-        plydata = PlyData.read(path)
+        vertices, names = read_vertex_matrix(path)
+        num_points = vertices.shape[0]
 
-        xyz = np.stack((np.asarray(plydata.elements[0]["x"]),
-                        np.asarray(plydata.elements[0]["y"]),
-                        np.asarray(plydata.elements[0]["z"])),  axis=1)
-        opacities = np.asarray(plydata.elements[0]["opacity"])[..., np.newaxis]
+        def sorted_names(prefix):
+            return sorted([name for name in names if name.startswith(prefix)], key = lambda x: int(x.split('_')[-1]))
 
-        features_dc = np.zeros((xyz.shape[0], 3, 1))
-        features_dc[:, 0, 0] = np.asarray(plydata.elements[0]["f_dc_0"])
-        features_dc[:, 1, 0] = np.asarray(plydata.elements[0]["f_dc_1"])
-        features_dc[:, 2, 0] = np.asarray(plydata.elements[0]["f_dc_2"])
-
-        extra_f_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("f_rest_")]
-        extra_f_names = sorted(extra_f_names, key = lambda x: int(x.split('_')[-1]))
+        extra_f_names = sorted_names("f_rest_")
         assert len(extra_f_names)==3*(self.max_sh_degree + 1) ** 2 - 3
-        features_extra = np.zeros((xyz.shape[0], len(extra_f_names)))
-        for idx, attr_name in enumerate(extra_f_names):
-            features_extra[:, idx] = np.asarray(plydata.elements[0][attr_name])
-        # Reshape (P,F*SH_coeffs) to (P, F, SH_coeffs except DC)
-        features_extra = features_extra.reshape((features_extra.shape[0], 3, (self.max_sh_degree + 1) ** 2 - 1))
-
-        scale_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("scale_")]
-        scale_names = sorted(scale_names, key = lambda x: int(x.split('_')[-1]))
-        scales = np.zeros((xyz.shape[0], len(scale_names)))
-        for idx, attr_name in enumerate(scale_names):
-            scales[:, idx] = np.asarray(plydata.elements[0][attr_name])
-
-        rot_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("rot")]
-        rot_names = sorted(rot_names, key = lambda x: int(x.split('_')[-1]))
-        rots = np.zeros((xyz.shape[0], len(rot_names)))
-        for idx, attr_name in enumerate(rot_names):
-            rots[:, idx] = np.asarray(plydata.elements[0][attr_name])
-
-        self._xyz = nn.Parameter(torch.tensor(xyz, dtype=torch.float, device="cuda").requires_grad_(True))
-        self._features_dc = nn.Parameter(torch.tensor(features_dc, dtype=torch.float, device="cuda").transpose(1, 2).contiguous().requires_grad_(True))
-        self._features_rest = nn.Parameter(torch.tensor(features_extra, dtype=torch.float, device="cuda").transpose(1, 2).contiguous().requires_grad_(True))
-        self._opacity = nn.Parameter(torch.tensor(opacities, dtype=torch.float, device="cuda").requires_grad_(True))
-        self._scaling = nn.Parameter(torch.tensor(scales, dtype=torch.float, device="cuda").requires_grad_(True))
-        self._rotation = nn.Parameter(torch.tensor(rots, dtype=torch.float, device="cuda").requires_grad_(True))
+
+        def upload(selected, sh_layout=False):
+            host = torch.from_numpy(select_columns(vertices, names, selected))
+            if sh_layout:
+                # Columns are stored as (P, F*SH_coeffs), parameters are (P, SH_coeffs, F)
+                host = host.reshape(num_points, 3, -1).transpose(1, 2)
+            # One copy out of the mapped file into the (pinned, if uploading) final layout
+            staging = torch.empty(host.shape, dtype=torch.float, pin_memory=self.device.type == "cuda")
+            staging.copy_(host)
+            return nn.Parameter(staging.to(self.device, non_blocking=True).requires_grad_(True))
+
+        self._xyz = upload(["x", "y", "z"])
+        self._features_dc = upload(["f_dc_0", "f_dc_1", "f_dc_2"], sh_layout=True)
+        self._features_rest = upload(extra_f_names, sh_layout=True)
+        self._opacity = upload(["opacity"])
+        self._scaling = upload(sorted_names("scale_"))
+        self._rotation = upload(sorted_names("rot"))
 
         self.active_sh_degree = self.max_sh_degree
 
@@ -300,6 +389,8 @@ class GaussianModel:
         self._rotation = optimizable_tensors["rotation"]
 
         self.xyz_gradient_accum = self.xyz_gradient_accum[valid_points_mask]
+        if self.spatial_index is not None:
+            self.spatial_index.prune(valid_points_mask)
 
         self.denom = self.denom[valid_points_mask]
         self.max_radii2D = self.max_radii2D[valid_points_mask]
@@ -341,22 +432,24 @@ class GaussianModel:
         self._opacity = optimizable_tensors["opacity"]
         self._scaling = optimizable_tensors["scaling"]
         self._rotation = optimizable_tensors["rotation"]
+        if self.spatial_index is not None:
+            self.spatial_index.append(new_xyz)
 
-        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
-        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
-        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device="cuda")
+        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device=self.device)
+        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device=self.device)
+        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device=self.device)
 
     def densify_and_split(self, grads, grad_threshold, scene_extent, N=2):
         n_init_points = self.get_xyz.shape[0]
         # Extract points that satisfy the gradient condition
-        padded_grad = torch.zeros((n_init_points), device="cuda")
+        padded_grad = torch.zeros((n_init_points), device=self.device)
         padded_grad[:grads.shape[0]] = grads.squeeze()
         selected_pts_mask = torch.where(padded_grad >= grad_threshold, True, False)
         selected_pts_mask = torch.logical_and(selected_pts_mask,
                                               torch.max(self.get_scaling, dim=1).values > self.percent_dense*scene_extent)
 
         stds = self.get_scaling[selected_pts_mask].repeat(N,1)
-        means =torch.zeros((stds.size(0), 3),device="cuda")
+        means =torch.zeros((stds.size(0), 3),device=self.device)
         samples = torch.normal(mean=means, std=stds)
         rots = build_rotation(self._rotation[selected_pts_mask]).repeat(N,1,1)
         new_xyz = torch.bmm(rots, samples.unsqueeze(-1)).squeeze(-1) + self.get_xyz[selected_pts_mask].repeat(N, 1)
@@ -368,7 +461,7 @@ class GaussianModel:
 
         self.densification_postfix(new_xyz, new_features_dc, new_features_rest, new_opacity, new_scaling, new_rotation)
 
-        prune_filter = torch.cat((selected_pts_mask, torch.zeros(N * selected_pts_mask.sum(), device="cuda", dtype=bool)))
+        prune_filter = torch.cat((selected_pts_mask, torch.zeros(N * selected_pts_mask.sum(), device=self.device, dtype=bool)))
         self.prune_points(prune_filter)
 
     def densify_and_clone(self, grads, grad_threshold, scene_extent):
@@ -0,0 +1,119 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import uuid
+import numpy as np
+import torch
+from PIL import Image
+from functools import partial
+from scene.dataset_readers import CameraInfo, SceneInfo, DeferredImage, fetchPly, compositeLUT, readCompositedImage
+from utils.checkpoint_utils import write_tensor_file, read_tensor_file
+
+# The index stores camera metadata, the normalization and the train/test
+# split of a parsed scene. It is valid as long as the loader parameters match
+# and the parsed source files keep their mtime and size. Images and the point
+# cloud are never cached, they are read from the source as usual; the image
+# sizes and alpha flags are, so Blender frames are decoded only when used.
+SCENE_INDEX_VERSION = 2
+
+def has_alpha(image):
+    if isinstance(image, np.ndarray):
+        return image.shape[2] == 4
+    return "A" in image.getbands()
+
+def source_stats(paths):
+    stats = []
+    for path in paths:
+        stat = os.stat(path)
+        stats.append([os.path.abspath(path), stat.st_mtime_ns, stat.st_size])
+    return stats
+
+def save_scene_index(path, scene_info, params):
+    cam_infos = scene_info.train_cameras + scene_info.test_cameras
+    if not cam_infos:
+        return
+    radius = np.atleast_1d(scene_info.nerf_normalization["radius"])
+    tensors = {
+        "uid": torch.tensor([c.uid for c in cam_infos], dtype=torch.int64),
+        "R": torch.from_numpy(np.stack([c.R for c in cam_infos]).astype(np.float64)),
+        "T": torch.from_numpy(np.stack([c.T for c in cam_infos]).astype(np.float64)),
+        "fov": torch.tensor([[c.FovX, c.FovY] for c in cam_infos], dtype=torch.float64),
+        "size": torch.tensor([[c.width, c.height] for c in cam_infos], dtype=torch.int64),
+        "has_alpha": torch.tensor([has_alpha(c.image) for c in cam_infos]),
+        "translate": torch.from_numpy(np.asarray(scene_info.nerf_normalization["translate"])),
+        "radius": torch.from_numpy(radius),
+    }
+    meta = {
+        "version": SCENE_INDEX_VERSION,
+        "params": params,
+        "sources": source_stats(scene_info.source_files),
+        "image_stats": [stat[1:] for stat in source_stats(c.image_path for c in cam_infos)],
+        "num_train": len(scene_info.train_cameras),
+        "image_paths": [c.image_path for c in cam_infos],
+        "image_names": [c.image_name for c in cam_infos],
+        "ply_path": scene_info.ply_path,
+    }
+    # Written under a unique name first so concurrent runs never read partial files
+    tmp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+    write_tensor_file(tmp_path, tensors, meta)
+    os.replace(tmp_path, path)
+
+def open_images(image_paths, sizes, alpha, params):
+    """Images of a Colmap scene opened lazily by PIL, Blender frames are composited once loaded."""
+    if params["type"] != "Blender":
+        return [Image.open(image_path) for image_path in image_paths]
+    decode = partial(readCompositedImage, lut=compositeLUT(params["white_background"]))
+    return [DeferredImage(image_path, tuple(size), "RGBA" if with_alpha else "RGB", decode)
+            for image_path, size, with_alpha in zip(image_paths, sizes, alpha)]
+
+def load_scene_index(path, params, load_point_cloud=True):
+    """
+    SceneInfo from the index at path, or None if it is missing or stale. The
+    point cloud is only read if load_point_cloud is set.
+    """
+    try:
+        tensors, meta = read_tensor_file(path)
+    except (OSError, ValueError):
+        return None
+    try:
+        if meta["version"] != SCENE_INDEX_VERSION or meta["params"] != params \
+                or meta["sources"] != source_stats(source for source, _, _ in meta["sources"]) \
+                or meta["image_stats"] != [stat[1:] for stat in source_stats(meta["image_paths"])] \
+                or not os.path.exists(meta["ply_path"]):
+            return None
+    except OSError:
+        return None
+
+    images = open_images(meta["image_paths"], tensors["size"].tolist(), tensors["has_alpha"].tolist(), params)
+    cam_infos = []
+    for idx, (image, image_path, image_name) in enumerate(zip(images, meta["image_paths"], meta["image_names"])):
+        width, height = tensors["size"][idx].tolist()
+        cam_infos.append(CameraInfo(uid=int(tensors["uid"][idx]), R=tensors["R"][idx].numpy().copy(),
+                                    T=tensors["T"][idx].numpy().copy(), FovY=float(tensors["fov"][idx, 1]),
+                                    FovX=float(tensors["fov"][idx, 0]), image=image, image_path=image_path,
+                                    image_name=image_name, width=width, height=height))
+
+    pcd = None
+    if load_point_cloud:
+        try:
+            pcd = fetchPly(meta["ply_path"])
+        except:
+            pcd = None
+
+    num_train = meta["num_train"]
+    nerf_normalization = {"translate": tensors["translate"].numpy().copy(), "radius": tensors["radius"].numpy()[0]}
+    return SceneInfo(point_cloud=pcd,
+                     train_cameras=cam_infos[:num_train],
+                     test_cameras=cam_infos[num_train:],
+                     nerf_normalization=nerf_normalization,
+                     ply_path=meta["ply_path"],
+                     source_files=tuple(source for source, _, _ in meta["sources"]))
@@ -0,0 +1,123 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import math
+import torch
+
+# Mirrors the culling rules of the rasterizers (see torch_rasterizer.py): a
+# Gaussian is dropped if its center is at most NEAR_PLANE deep in view space
+# or if its screen space tile rectangle is empty.
+NEAR_PLANE = 0.2
+BLOCK_SIZE = 16
+
+class SpatialIndex:
+    """
+    Uniform grid over the Gaussian centers for conservative frustum culling.
+    Every Gaussian keeps the cell it was assigned to when it was added; the
+    per cell bounds of the centers and the largest scale are refit from the
+    current parameters whenever those changed, so moving Gaussians only
+    loosen the culling and never make it wrong. Points outside the grid
+    frame are clamped into its border cells.
+    """
+
+    def __init__(self, xyz, gaussians_per_cell=64, max_cells_per_axis=128):
+        xyz = xyz.detach()
+        lo = xyz.amin(dim=0)
+        extent = torch.clamp_min(xyz.amax(dim=0) - lo, 1e-6)
+        num_cells = max(1, xyz.shape[0] // gaussians_per_cell)
+        cell_size = (torch.prod(extent).item() / num_cells) ** (1.0 / 3.0)
+        self.dims = torch.clamp(torch.ceil(extent / cell_size), 1, max_cells_per_axis).long()
+        self.origin = lo
+        self.cell_size = extent / self.dims
+        self.num_cells = int(torch.prod(self.dims))
+        self.cell_ids = self.assign(xyz)
+        self.fitted = None
+
+    def __len__(self):
+        return self.cell_ids.shape[0]
+
+    def assign(self, xyz):
+        cell = torch.floor((xyz.detach() - self.origin) / self.cell_size).long()
+        cell = torch.minimum(torch.clamp_min(cell, 0), self.dims - 1)
+        return (cell[:, 0] * self.dims[1] + cell[:, 1]) * self.dims[2] + cell[:, 2]
+
+    def prune(self, valid_mask):
+        self.cell_ids = self.cell_ids[valid_mask]
+        self.fitted = None
+
+    def append(self, xyz):
+        self.cell_ids = torch.cat((self.cell_ids, self.assign(xyz)))
+        self.fitted = None
+
+    def refit(self, xyz, scaling, state=None):
+        """
+        Per cell (occupied, min corner, max corner, max scale) of the given
+        parameters. The bounds are reused while state (any comparable value
+        identifying the parameters) does not change, None always refits.
+        """
+        if state is not None and self.fitted is not None and self.fitted[0] == state:
+            return self.fitted[1]
+        xyz = xyz.detach()
+        ids = self.cell_ids[:, None].expand(-1, 3)
+        lo = torch.zeros((self.num_cells, 3), dtype=xyz.dtype, device=xyz.device).scatter_reduce(0, ids, xyz, "amin", include_self=False)
+        hi = torch.zeros((self.num_cells, 3), dtype=xyz.dtype, device=xyz.device).scatter_reduce(0, ids, xyz, "amax", include_self=False)
+        max_scale = torch.zeros(self.num_cells, dtype=xyz.dtype, device=xyz.device).scatter_reduce(
+            0, self.cell_ids, scaling.detach().amax(dim=1), "amax", include_self=False)
+        occupied = torch.bincount(self.cell_ids, minlength=self.num_cells) > 0
+        self.fitted = (state, (occupied, lo, hi, max_scale))
+        return self.fitted[1]
+
+    def visible_cells(self, camera, bounds, scaling_modifier=1.0):
+        """Cells that may hold a Gaussian the rasterizer keeps for camera."""
+        occupied, lo, hi, max_scale = bounds
+        corners = torch.stack([torch.stack((x[:, 0], y[:, 1], z[:, 2]), dim=-1)
+                               for x in (lo, hi) for y in (lo, hi) for z in (lo, hi)], dim=1)
+        corners = torch.cat((corners, torch.ones_like(corners[..., :1])), dim=-1)
+        depth = (corners @ camera.world_view_transform)[..., 2]
+        p_hom = corners @ camera.full_proj_transform
+        p_proj = p_hom[..., :2] / (p_hom[..., 3:4] + 0.0000001)
+        width, height = int(camera.image_width), int(camera.image_height)
+        u = ((p_proj[..., 0] + 1.0) * width - 1.0) * 0.5
+        v = ((p_proj[..., 1] + 1.0) * height - 1.0) * 0.5
+        min_depth = depth.amin(dim=1)
+
+        # Screen x / z is linear fractional in the position, so with the box in
+        # front of the camera the centers project into the hull of the corners.
+        # The radius bound follows from the rasterizer's 2D covariance,
+        # lambda1 <= |J|_F^2 * s_max^2 + 0.92 with the Jacobian J clamped to
+        # 1.3 times the field of view, and one extra pixel for rounding.
+        tanfovx, tanfovy = math.tan(camera.FoVx * 0.5), math.tan(camera.FoVy * 0.5)
+        focal_x, focal_y = width / (2.0 * tanfovx), height / (2.0 * tanfovy)
+        jacobian = focal_x ** 2 * (1.0 + 1.69 * tanfovx ** 2) + focal_y ** 2 * (1.0 + 1.69 * tanfovy ** 2)
+        radius = torch.ceil(3.0 * torch.sqrt(jacobian * (max_scale * scaling_modifier) ** 2 / torch.clamp_min(min_depth, NEAR_PLANE) ** 2 + 0.92)) + 1.0
+        grid_width = (width + BLOCK_SIZE - 1) // BLOCK_SIZE * BLOCK_SIZE
+        grid_height = (height + BLOCK_SIZE - 1) // BLOCK_SIZE * BLOCK_SIZE
+        on_screen = (u.amax(dim=1) + radius >= 1) & (u.amin(dim=1) - radius < grid_width) \
+            & (v.amax(dim=1) + radius >= 1) & (v.amin(dim=1) - radius < grid_height)
+
+        # Boxes crossing the near plane cannot be bounded on screen, keep them
+        margin = 1e-3
+        crosses_near = min_depth <= NEAR_PLANE + margin
+        in_front = depth.amax(dim=1) > NEAR_PLANE - margin
+        return occupied & in_front & (on_screen | crosses_near)
+
+    def visible(self, cameras, xyz, scaling, scaling_modifier=1.0, state=None):
+        """
+        Indices of the Gaussians in cells seen by any of cameras, or None if
+        no Gaussian could be culled.
+        """
+        bounds = self.refit(xyz, scaling, state)
+        cells = torch.zeros(self.num_cells, dtype=torch.bool, device=xyz.device)
+        for camera in cameras:
+            cells |= self.visible_cells(camera, bounds, scaling_modifier)
+        if bool(cells[bounds[0]].all()):
+            return None
+        return torch.nonzero(cells[self.cell_ids]).squeeze(1)
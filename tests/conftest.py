@@ -0,0 +1,16 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import sys
+
+# Tests import the repository modules the same way the scripts at its root do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,28 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import numpy as np
+import torch
+from scene.cameras import Camera
+
+def make_camera(**kwargs):
+    return Camera(0, np.eye(3), np.zeros(3), 1.0, 1.0, torch.rand(3, 4, 6), None, "view", 0, **kwargs)
+
+def test_tensors_follow_data_device():
+    camera = make_camera(data_device="cpu")
+    assert camera.original_image.device.type == "cpu"
+    assert camera.world_view_transform.device.type == "cpu"
+
+def test_invalid_data_device_falls_back_to_device():
+    camera = make_camera(data_device="not_a_device", device="cpu")
+    assert camera.data_device == torch.device("cpu")
+    assert camera.original_image.device.type == "cpu"
+    assert camera.camera_center.device.type == "cpu"
@@ -0,0 +1,57 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+from argparse import ArgumentParser
+import numpy as np
+import torch
+from arguments import OptimizationParams
+from scene.gaussian_model import GaussianModel
+from utils.graphics_utils import BasicPointCloud
+from utils.persistence_utils import BackgroundWriter
+
+def trained_model(opt):
+    generator = np.random.default_rng(0)
+    points = generator.random((200, 3))
+    gaussians = GaussianModel(3, "cpu")
+    gaussians.create_from_pcd(BasicPointCloud(points=points, colors=generator.random((200, 3)), normals=np.zeros((200, 3))), 1.0)
+    gaussians.training_setup(opt)
+    # One step, so the optimizer has state to save
+    loss = sum(param.square().sum() for param in (gaussians._xyz, gaussians._features_dc, gaussians._features_rest,
+                                                  gaussians._scaling, gaussians._rotation, gaussians._opacity))
+    loss.backward()
+    gaussians.optimizer.step()
+    gaussians.optimizer.zero_grad(set_to_none=True)
+    return gaussians
+
+def test_async_pth_round_trip(tmp_path):
+    opt = OptimizationParams(ArgumentParser())
+    gaussians = trained_model(opt)
+    expected = [tensor.detach().clone() for tensor in (gaussians._xyz, gaussians._features_rest, gaussians._opacity)]
+    expected_state = {key: value.clone() for key, value in gaussians.optimizer.state_dict()["state"][0].items()}
+
+    writer = BackgroundWriter()
+    path = str(tmp_path / "chkpnt7.pth")
+    gaussians.save_capture(path, 7, writer)
+    # Training goes on while the file is written, the snapshot must not see it
+    with torch.no_grad():
+        gaussians._xyz.add_(1.0)
+        gaussians.optimizer.state_dict()["state"][0]["exp_avg"].add_(1.0)
+    writer.close()
+
+    (model_params, iteration) = torch.load(path, map_location="cpu")
+    restored = GaussianModel(3, "cpu")
+    restored.restore(model_params, opt)
+    assert iteration == 7
+    for tensor, expected_tensor in zip((restored._xyz, restored._features_rest, restored._opacity), expected):
+        assert isinstance(tensor, torch.nn.Parameter) and tensor.requires_grad
+        assert torch.equal(tensor.detach(), expected_tensor)
+    for key, value in restored.optimizer.state_dict()["state"][0].items():
+        assert torch.equal(value, expected_state[key])
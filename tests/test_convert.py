@@ -0,0 +1,85 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import sys
+import subprocess
+import pytest
+from PIL import Image
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Stand-in for the colmap executable: logs each command and writes the
+# outputs the real one would produce
+STUB_COLMAP = '''#!{python}
+import os, sys, shutil
+args = sys.argv[1:]
+options = dict(zip(args[1::2], args[2::2]))
+with open(os.environ["STUB_COLMAP_LOG"], "a") as fid:
+    fid.write(args[0] + "\\n")
+if args[0] == "feature_extractor" or args[0] == "exhaustive_matcher":
+    with open(options["--database_path"], "a") as fid:
+        fid.write(args[0])
+elif args[0] == "mapper":
+    os.makedirs(os.path.join(options["--output_path"], "0"))
+    open(os.path.join(options["--output_path"], "0", "cameras.bin"), "w").close()
+elif args[0] == "image_undistorter":
+    shutil.copytree(options["--image_path"], os.path.join(options["--output_path"], "images"), dirs_exist_ok=True)
+    os.makedirs(os.path.join(options["--output_path"], "sparse"), exist_ok=True)
+    open(os.path.join(options["--output_path"], "sparse", "cameras.bin"), "w").close()
+'''
+
+@pytest.fixture
+def dataset(tmp_path):
+    colmap = tmp_path / "colmap"
+    colmap.write_text(STUB_COLMAP.format(python=sys.executable))
+    colmap.chmod(0o755)
+    source = tmp_path / "scene"
+    os.makedirs(source / "input" / "extra")
+    for name in ("a.png", "b.png", os.path.join("extra", "c.png")):
+        Image.new("RGB", (8, 6), (10, 20, 30)).save(source / "input" / name)
+    return source, colmap, tmp_path / "colmap.log"
+
+def run_convert(dataset, *extra):
+    source, colmap, log = dataset
+    if log.exists():
+        log.unlink()
+    subprocess.run([sys.executable, os.path.join(REPO, "convert.py"), "-s", str(source), "--colmap_executable", str(colmap)] + list(extra),
+                   check=True, cwd=REPO, env=dict(os.environ, STUB_COLMAP_LOG=str(log)), stdout=subprocess.DEVNULL)
+    return log.read_text().split() if log.exists() else []
+
+ALL_STAGES = ["feature_extractor", "exhaustive_matcher", "mapper", "image_undistorter"]
+
+def test_stages_are_skipped_until_inputs_change(dataset):
+    assert run_convert(dataset) == ALL_STAGES
+    assert run_convert(dataset) == []
+
+    # Same content with a new mtime is rehashed but does not rerun matching
+    image = dataset[0] / "input" / "extra" / "c.png"
+    os.utime(image, ns=(image.stat().st_atime_ns, image.stat().st_mtime_ns + 10 ** 9))
+    assert run_convert(dataset) == []
+
+    Image.new("RGB", (8, 6), (40, 50, 60)).save(image)
+    assert run_convert(dataset) == ALL_STAGES
+    assert run_convert(dataset) == []
+
+def test_skip_matching_does_not_hash_inputs(dataset):
+    assert run_convert(dataset) == ALL_STAGES
+    os.remove(dataset[0] / "convert_manifest.json")
+    assert run_convert(dataset, "--skip_matching") == ["image_undistorter"]
+    assert run_convert(dataset, "--skip_matching") == []
+    with open(dataset[0] / "convert_manifest.json") as fid:
+        assert '"inputs": {}' in fid.read()
+
+    # Without content hashes, any touched input reruns the undistortion
+    image = dataset[0] / "input" / "a.png"
+    os.utime(image, ns=(image.stat().st_atime_ns, image.stat().st_mtime_ns + 10 ** 9))
+    assert run_convert(dataset, "--skip_matching") == ["image_undistorter"]
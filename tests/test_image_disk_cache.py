@@ -0,0 +1,48 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import numpy as np
+from utils.image_disk_cache import ImageDiskCache
+
+def image(value):
+    return np.full((16, 16, 3), value, dtype=np.uint8)
+
+def test_reads_are_not_mapped(tmp_path):
+    cache = ImageDiskCache(str(tmp_path))
+    cache.put("a", image(1))
+    array = cache.get("a")
+    assert not isinstance(array, np.memmap) and np.array_equal(array, image(1))
+    # Nothing refers to the file any more
+    os.remove(cache.path("a"))
+    assert array.sum() == 16 * 16 * 3
+    assert cache.get("a") is None
+
+def test_evict_keeps_entries_of_this_run(tmp_path):
+    previous_run = ImageDiskCache(str(tmp_path))
+    for idx, key in enumerate(("old0", "old1", "old2")):
+        previous_run.put(key, image(idx))
+        os.utime(previous_run.path(key), ns=(idx * 10 ** 9, idx * 10 ** 9))
+    entry_size = os.path.getsize(previous_run.path("old0"))
+
+    # This run writes new entries and reads the oldest one, then trims to a
+    # size that only its own entries already exceed
+    cache = ImageDiskCache(str(tmp_path), max_bytes=entry_size)
+    cache.put("new0", image(3))
+    cache.put("new1", image(4))
+    assert cache.get("old0") is not None
+    removed, total = cache.evict()
+    assert removed == 2 and total == 3 * entry_size
+    assert sorted(fname[:-4] for _, _, fname in cache.entries()) == ["new0", "new1", "old0"]
+
+    # A later run may evict them again
+    removed, _ = ImageDiskCache(str(tmp_path), max_bytes=entry_size).evict()
+    assert removed == 2
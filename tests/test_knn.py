@@ -0,0 +1,59 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import pytest
+import torch
+from utils.general_utils import knn_mean_dist2
+try:
+    from simple_knn._C import distCUDA2
+    SIMPLE_KNN_FOUND = True
+except ImportError:
+    SIMPLE_KNN_FOUND = False
+
+def reference_mean_dist2(points, k=3):
+    points = points.double()
+    dist2 = ((points[:, None] - points[None]) ** 2).sum(dim=-1)
+    dist2.fill_diagonal_(float("inf"))
+    return dist2.topk(min(k, points.shape[0] - 1), dim=1, largest=False).values.mean(dim=1)
+
+def clouds():
+    generator = torch.Generator().manual_seed(0)
+    def rand(*shape):
+        return torch.rand(*shape, generator=generator)
+    def randn(*shape):
+        return torch.randn(*shape, generator=generator)
+    return {
+        "uniform": rand(3000, 3) * 10,
+        "slab": rand(3000, 3) * torch.tensor([100.0, 100.0, 1.0]),
+        "clustered": torch.cat((randn(1000, 3) * 0.01, randn(1000, 3) * 5 + 20, rand(200, 3) * 1000)),
+        "duplicates": torch.cat((torch.zeros(400, 3), rand(1000, 3))),
+        "outlier": torch.cat((rand(1000, 3), torch.tensor([[1e5, 1e5, 1e5]]))),
+        "tiny": rand(3, 3),
+    }
+
+@pytest.mark.parametrize("name", list(clouds().keys()))
+def test_matches_brute_force(name):
+    points = clouds()[name]
+    torch.testing.assert_close(knn_mean_dist2(points).double(), reference_mean_dist2(points), rtol=1e-3, atol=1e-10)
+
+def test_small_candidate_limit_and_budget():
+    # Forces the finer / coarser level switches and tiny chunks
+    points = clouds()["clustered"]
+    torch.testing.assert_close(knn_mean_dist2(points, max_candidates=8, budget_elems=4096).double(),
+                               reference_mean_dist2(points), rtol=1e-3, atol=1e-10)
+
+def test_single_point():
+    assert knn_mean_dist2(torch.rand(1, 3)).tolist() == [0.0]
+
+@pytest.mark.skipif(not (SIMPLE_KNN_FOUND and torch.cuda.is_available()), reason="simple_knn is not installed")
+def test_matches_simple_knn():
+    points = clouds()["uniform"].cuda()
+    torch.testing.assert_close(knn_mean_dist2(points), distCUDA2(points), rtol=1e-3, atol=1e-10)
@@ -0,0 +1,51 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+from types import SimpleNamespace
+import numpy as np
+import torch
+from PIL import Image
+import scene  # before utils.camera_utils, which it imports
+import utils.camera_utils as camera_utils
+from scene.dataset_readers import CameraInfo
+from utils.image_cache import ImageCache
+
+def make_cam_infos(path, count=2):
+    cam_infos = []
+    for idx in range(count):
+        image_path = str(path / "{}.png".format(idx))
+        Image.fromarray(np.random.default_rng(idx).integers(0, 256, (32, 48, 3), dtype=np.uint8)).save(image_path)
+        cam_infos.append(CameraInfo(uid=idx, R=np.eye(3), T=np.array([idx, 0.0, 4.0]), FovY=0.6, FovX=0.8,
+                                    image=Image.open(image_path), image_path=image_path, image_name=str(idx),
+                                    width=48, height=32))
+    return cam_infos
+
+def test_lazy_views_decode_once_for_all_scales(tmp_path, monkeypatch):
+    args = SimpleNamespace(resolution=1, white_background=False, compact_images=False, data_device="cpu",
+                           device="cpu", load_workers=1)
+    cam_infos = make_cam_infos(tmp_path)
+    scales = [1.0, 2.0, 4.0]
+    decodes = []
+    load_images = camera_utils.loadCamImages
+    monkeypatch.setattr(camera_utils, "loadCamImages", lambda args, cam_info, *rest: decodes.append(cam_info.uid) or load_images(args, cam_info, *rest))
+
+    lists = camera_utils.cameraLists_from_camInfos(cam_infos, scales, args, ImageCache(1 << 30))
+    assert decodes == []
+    for scale in scales:
+        for camera in lists[scale]:
+            camera.fetch_image()
+    assert decodes == [0, 1]
+
+    # Same images as the eager path
+    eager = camera_utils.cameraLists_from_camInfos(cam_infos, scales, args)
+    for scale in scales:
+        for camera, eager_camera in zip(lists[scale], eager[scale]):
+            assert torch.equal(camera.fetch_image(), eager_camera.fetch_image())
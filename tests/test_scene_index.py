@@ -0,0 +1,80 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import json
+from types import SimpleNamespace
+import numpy as np
+from PIL import Image
+import scene  # before utils.camera_utils, which it imports
+from scene.dataset_readers import DeferredImage, readNerfSyntheticInfo
+from scene.scene_index import load_scene_index, save_scene_index
+from utils.camera_utils import loadResizedImages
+from utils.system_utils import copy_if_changed
+
+def make_blender_scene(path):
+    generator = np.random.default_rng(0)
+    for split in ("train", "test"):
+        frames = []
+        for idx in range(2):
+            name = "{}_{}".format(split, idx)
+            Image.fromarray(generator.integers(0, 256, (12, 20, 4), dtype=np.uint8)).save(os.path.join(path, name + ".png"))
+            c2w = np.eye(4)
+            c2w[:3, 3] = [idx, 0.0, 4.0]
+            frames.append({"file_path": name, "transform_matrix": c2w.tolist()})
+        with open(os.path.join(path, "transforms_{}.json".format(split)), "w") as fid:
+            json.dump({"camera_angle_x": 0.8, "frames": frames}, fid)
+
+def test_blender_index_defers_decoding(tmp_path, monkeypatch):
+    make_blender_scene(str(tmp_path))
+    params = {"type": "Blender", "source_path": str(tmp_path), "white_background": True, "eval": True}
+    scene_info = readNerfSyntheticInfo(str(tmp_path), True, True, num_workers=1)
+    index_path = str(tmp_path / "scene_index.bin")
+    save_scene_index(index_path, scene_info, params)
+
+    decoded = []
+    monkeypatch.setattr(DeferredImage, "load", lambda self: decoded.append(self.image_path) or self.decode(self.image_path))
+    indexed = load_scene_index(index_path, params, load_point_cloud=False)
+    assert decoded == []
+
+    args = SimpleNamespace(resolution=2, white_background=True)
+    cam_infos = scene_info.train_cameras + scene_info.test_cameras
+    indexed_infos = indexed.train_cameras + indexed.test_cameras
+    for cam_info, indexed_info in zip(cam_infos, indexed_infos):
+        assert (indexed_info.width, indexed_info.height) == (20, 12)
+        expected = loadResizedImages(args, cam_info, [1.0, 2.0])
+        for image, expected_image in zip(loadResizedImages(args, indexed_info, [1.0, 2.0]), expected):
+            assert np.array_equal(image, expected_image)
+    assert len(decoded) == len(cam_infos)
+
+    # A replaced image invalidates the index
+    Image.new("RGBA", (40, 24)).save(cam_infos[0].image_path)
+    assert load_scene_index(index_path, params, load_point_cloud=False) is None
+
+def test_copy_if_changed_never_shares_data(tmp_path):
+    src, dst = tmp_path / "points3d.ply", tmp_path / "input.ply"
+    src.write_bytes(b"source")
+    os.link(src, dst)
+    copy_if_changed(str(src), str(dst))
+    assert not os.path.samefile(src, dst)
+    with open(dst, "r+b") as fid:
+        fid.write(b"X")
+    assert src.read_bytes() == b"source"
+
+    # The edited copy is refreshed, an untouched one is kept
+    copy_if_changed(str(src), str(dst))
+    assert dst.read_bytes() == b"source"
+    dst_mtime = os.stat(dst).st_mtime_ns
+    copy_if_changed(str(src), str(dst))
+    assert os.stat(dst).st_mtime_ns == dst_mtime
+    src.write_bytes(b"changed")
+    copy_if_changed(str(src), str(dst))
+    assert dst.read_bytes() == b"changed"
@@ -0,0 +1,38 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import threading
+import pytest
+from scene import Scene
+from utils.camera_utils import ViewpointStack
+
+def failed_scene():
+    # Scene state right after the background loader stopped on an error
+    scene = Scene.__new__(Scene)
+    scene.train_cameras = {1.0: ["a", "b"]}
+    scene.test_cameras = {1.0: []}
+    scene.loaded_views = 2
+    scene.loading_done = True
+    scene.loading_error = OSError("corrupt image")
+    scene.loading_condition = threading.Condition()
+    return scene
+
+def test_train_cameras_raise_loading_error():
+    scene = failed_scene()
+    with pytest.raises(RuntimeError) as error:
+        scene.getTrainCameras()
+    assert isinstance(error.value.__cause__, OSError)
+    with pytest.raises(RuntimeError):
+        scene.getTestCameras()
+
+def test_viewpoint_stack_refill_fails_fast():
+    with pytest.raises(RuntimeError):
+        ViewpointStack(failed_scene().getTrainCameras).pop()
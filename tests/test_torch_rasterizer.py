@@ -0,0 +1,117 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import math
+import numpy as np
+import pytest
+import torch
+from gaussian_renderer.torch_rasterizer import RasterizationSettings, TorchGaussianRasterizer, compute_cov2D, compute_cov3D, preprocess
+from utils.graphics_utils import getWorld2View2, getProjectionMatrix
+try:
+    from diff_gaussian_rasterization import GaussianRasterizationSettings, GaussianRasterizer
+    CUDA_RASTERIZER_FOUND = True
+except ImportError:
+    CUDA_RASTERIZER_FOUND = False
+
+def make_settings(width, height, fov=1.0, dtype=torch.float32, device="cpu", bg=(0.1, 0.2, 0.3), Settings=RasterizationSettings):
+    # Camera at (0, 0, -4) looking down +z
+    R, T = np.eye(3), np.array([0.0, 0.0, 4.0])
+    fovy = 2.0 * math.atan(math.tan(fov * 0.5) * height / width)
+    world_view = torch.tensor(getWorld2View2(R, T)).transpose(0, 1).to(device, dtype)
+    projection = getProjectionMatrix(0.01, 100.0, fov, fovy).transpose(0, 1).to(device, dtype)
+    return Settings(image_height=height, image_width=width, tanfovx=math.tan(fov * 0.5), tanfovy=math.tan(fovy * 0.5),
+                    bg=torch.tensor(bg, dtype=dtype, device=device), scale_modifier=1.0, viewmatrix=world_view,
+                    projmatrix=world_view @ projection, sh_degree=0,
+                    campos=torch.linalg.inv(world_view)[3, :3], prefiltered=False, debug=False)
+
+def make_scene(count, seed=0, dtype=torch.float32):
+    generator = torch.Generator().manual_seed(seed)
+    means3D = (torch.rand(count, 3, generator=generator) * 2 - 1) * torch.tensor([1.5, 1.0, 1.0])
+    scales = torch.rand(count, 3, generator=generator) * 0.25 + 0.02
+    rotations = torch.nn.functional.normalize(torch.randn(count, 4, generator=generator), dim=1)
+    opacities = torch.rand(count, 1, generator=generator) * 0.9 + 0.05
+    colors = torch.rand(count, 3, generator=generator)
+    return [value.to(dtype) for value in (means3D, scales, rotations, opacities, colors)]
+
+def render(settings, means3D, scales, rotations, opacities, colors):
+    means2D = torch.zeros_like(means3D)
+    return TorchGaussianRasterizer(settings)(means3D, means2D, opacities, colors_precomp=colors, scales=scales, rotations=rotations)
+
+def sequential_reference(settings, means3D, scales, rotations, opacities, colors):
+    """Pixel by pixel front to back blending with the CUDA kernel's rules."""
+    cov3D = compute_cov3D(scales, rotations, 1.0)
+    point_image, depths, conic, opacity, colors, radii, rect = [value.detach().double() for value in preprocess(
+        means3D, torch.zeros_like(means3D), opacities, None, colors, cov3D, settings)]
+    order = [i for i in torch.argsort(depths).tolist() if radii[i] > 0]
+    image = torch.zeros(3, settings.image_height, settings.image_width, dtype=torch.float64)
+    for y in range(settings.image_height):
+        for x in range(settings.image_width):
+            tile_x, tile_y = x // 16, y // 16
+            T, C = 1.0, torch.zeros(3, dtype=torch.float64)
+            for i in order:
+                if not (rect[i, 0] <= tile_x < rect[i, 2] and rect[i, 1] <= tile_y < rect[i, 3]):
+                    continue
+                dx, dy = point_image[i, 0] - x, point_image[i, 1] - y
+                power = -0.5 * (conic[i, 0] * dx * dx + conic[i, 2] * dy * dy) - conic[i, 1] * dx * dy
+                if power > 0:
+                    continue
+                alpha = min(0.99, float(opacity[i] * torch.exp(power)))
+                if alpha < 1.0 / 255.0:
+                    continue
+                test_T = T * (1 - alpha)
+                if test_T < 0.0001:
+                    break
+                C += colors[i] * alpha * T
+                T = test_T
+            image[:, y, x] = C + T * settings.bg.double()
+    return image
+
+def test_matches_sequential_reference():
+    # Several tiles, partial border tiles and enough overlap to saturate pixels
+    settings = make_settings(37, 21)
+    scene = make_scene(40)
+    image, _ = render(settings, *scene)
+    torch.testing.assert_close(image.double(), sequential_reference(settings, *scene), rtol=0, atol=1e-5)
+
+def test_radii_and_visibility():
+    settings = make_settings(64, 48)
+    means3D, scales, rotations, opacities, colors = make_scene(4)
+    # In view, behind the camera, far off screen to the right, inside the near plane
+    means3D = torch.tensor([[0.2, -0.1, 0.5], [0.0, 0.0, -6.0], [40.0, 0.0, 0.0], [0.0, 0.0, -3.9]])
+    _, radii = render(settings, means3D, scales, rotations, opacities, colors)
+    assert radii[0] > 0 and radii[1:].tolist() == [0, 0, 0]
+
+    p_view = torch.cat((means3D, torch.ones_like(means3D[:, :1])), dim=1) @ settings.viewmatrix
+    a, b, c = compute_cov2D(p_view[:1], compute_cov3D(scales[:1], rotations[:1], 1.0), settings)
+    lambda1 = torch.linalg.eigvalsh(torch.tensor([[a.item(), b.item()], [b.item(), c.item()]], dtype=torch.float64))[-1]
+    assert radii[0].item() == math.ceil(3.0 * math.sqrt(lambda1))
+
+def test_gradcheck():
+    settings = make_settings(12, 10, dtype=torch.float64)
+    means3D, scales, rotations, opacities, colors = make_scene(3, seed=1, dtype=torch.float64)
+    means3D = means3D * 0.3
+    inputs = [value.requires_grad_() for value in (means3D, scales, opacities, colors)]
+    assert torch.autograd.gradcheck(lambda means3D, scales, opacities, colors: render(
+        settings, means3D, scales, rotations, opacities, colors)[0], inputs, eps=1e-6, atol=1e-5)
+
+@pytest.mark.skipif(not (CUDA_RASTERIZER_FOUND and torch.cuda.is_available()), reason="diff_gaussian_rasterization is not installed")
+def test_matches_cuda_rasterizer():
+    scene = [value.cuda() for value in make_scene(200)]
+    means3D, scales, rotations, opacities, colors = scene
+    images, all_radii = [], []
+    for Settings, Rasterizer in ((RasterizationSettings, TorchGaussianRasterizer), (GaussianRasterizationSettings, GaussianRasterizer)):
+        settings = make_settings(80, 60, device="cuda", Settings=Settings)
+        image, radii = Rasterizer(settings)(means3D, torch.zeros_like(means3D), opacities, colors_precomp=colors,
+                                            scales=scales, rotations=rotations)
+        images.append(image)
+        all_radii.append(radii)
+    torch.testing.assert_close(images[0], images[1], rtol=0, atol=1e-3)
+    assert torch.equal(all_radii[0], all_radii[1])
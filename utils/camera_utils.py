@@ -9,18 +9,33 @@
 # For inquiries contact  george.drettakis@inria.fr
 #
 
-from scene.cameras import Camera
+from scene.cameras import Camera, CameraBatch
+from scene.dataset_readers import DeferredImage
 import numpy as np
-from utils.general_utils import PILtoTorch
+import torch
+from utils.general_utils import ArrayToTorch
 from utils.graphics_utils import fov2focal
+from utils.image_disk_cache import image_key
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from random import randint
+from collections import deque
+from PIL import Image
+from tqdm import tqdm
 
 WARNED = False
 
-def loadCam(args, id, cam_info, resolution_scale):
-    orig_w, orig_h = cam_info.image.size
+def imageSize(image):
+    """(width, height) of a PIL or deferred image or of an HxWxC uint8 array."""
+    if isinstance(image, np.ndarray):
+        return image.shape[1], image.shape[0]
+    return image.size
+
+def computeResolution(args, cam_info, resolution_scale):
+    orig_w, orig_h = imageSize(cam_info.image)
 
     if args.resolution in [1, 2, 4, 8]:
-        resolution = round(orig_w/(resolution_scale * args.resolution)), round(orig_h/(resolution_scale * args.resolution))
+        return round(orig_w/(resolution_scale * args.resolution)), round(orig_h/(resolution_scale * args.resolution))
     else:  # should be a type that converts to float
         if args.resolution == -1:
             if orig_w > 1600:
@@ -36,9 +51,66 @@ def loadCam(args, id, cam_info, resolution_scale):
             global_down = orig_w / args.resolution
 
         scale = float(global_down) * float(resolution_scale)
-        resolution = (int(orig_w / scale), int(orig_h / scale))
+        return (int(orig_w / scale), int(orig_h / scale))
+
+def imageKey(args, cam_info, resolution):
+    # The in-memory image may already be alpha composited (Blender), hence mode and background in the key
+    mode = "RGB" if isinstance(cam_info.image, np.ndarray) else cam_info.image.mode
+    return image_key(cam_info.image_path, resolution, (mode, args.white_background))
+
+def loadResizedImages(args, cam_info, resolution_scales, reopen=False, disk_cache=None):
+    """
+    Image pyramid of cam_info at every resolution scale, as HxWxC uint8
+    arrays. The source is decoded at most once and every level is resized
+    from it, levels found in disk_cache need no decode at all.
+    """
+    images = []
+    source = None
+    decoded = cam_info.image if isinstance(cam_info.image, np.ndarray) else None
+    try:
+        for resolution_scale in resolution_scales:
+            resolution = computeResolution(args, cam_info, resolution_scale)
+
+            resized_image = None
+            if disk_cache is not None:
+                key = imageKey(args, cam_info, resolution)
+                resized_image = disk_cache.get(key)
+
+            if resized_image is None and isinstance(cam_info.image, DeferredImage) and decoded is None:
+                decoded = cam_info.image.load()
 
-    resized_image_rgb = PILtoTorch(cam_info.image, resolution)
+            if resized_image is None and decoded is not None:
+                # Already decoded (e.g. alpha composited Blender frames), only resize if needed
+                if resolution == imageSize(decoded):
+                    resized_image = decoded
+                else:
+                    resized_image = np.array(Image.fromarray(decoded).resize(resolution))
+                if disk_cache is not None:
+                    disk_cache.put(key, resized_image)
+
+            if resized_image is None:
+                if source is None:
+                    if reopen and getattr(cam_info.image, "filename", None):
+                        # Decode from a fresh file handle so the shared PIL image never keeps
+                        # the full resolution pixels alive (or gets loaded by two threads).
+                        source = Image.open(cam_info.image.filename)
+                    else:
+                        source = cam_info.image
+                    source.load()
+                resized_image = np.array(source.resize(resolution))
+                if disk_cache is not None:
+                    disk_cache.put(key, resized_image)
+
+            images.append(resized_image)
+    finally:
+        if source is not None and source is not cam_info.image:
+            source.close()
+    return images
+
+def camImageTensors(args, resized_image):
+    """(gt_image, mask) tensors of a resized HxWxC uint8 image."""
+    # uint8 tensors are kept as is by compact cameras
+    resized_image_rgb = ArrayToTorch(resized_image, normalize=not args.compact_images)
 
     gt_image = resized_image_rgb[:3, ...]
     loaded_mask = None
@@ -46,18 +118,141 @@ def loadCam(args, id, cam_info, resolution_scale):
     if resized_image_rgb.shape[1] == 4:
         loaded_mask = resized_image_rgb[3:4, ...]
 
+    return gt_image, loaded_mask
+
+def loadCamImages(args, cam_info, resolution_scales, reopen=False, disk_cache=None):
+    """Image pyramid of cam_info as (gt_image, mask) pairs, see loadResizedImages."""
+    return [camImageTensors(args, image) for image in loadResizedImages(args, cam_info, resolution_scales, reopen, disk_cache)]
+
+class ViewImageLoader:
+    """
+    Image loader shared by the lazy cameras of one view, one per resolution
+    scale. A miss decodes the source once into the whole pyramid and also
+    puts the prepared images of the other scales into their cameras' cache.
+    """
+
+    def __init__(self, args, cam_info, resolution_scales, disk_cache=None):
+        self.args = args
+        self.cam_info = cam_info
+        self.resolution_scales = resolution_scales
+        self.disk_cache = disk_cache
+        self.cameras = {}
+
+    def loader(self, resolution_scale):
+        return partial(self.load, resolution_scale)
+
+    def load(self, resolution_scale):
+        images = loadCamImages(self.args, self.cam_info, self.resolution_scales, True, self.disk_cache)
+        for scale, image in zip(self.resolution_scales, images):
+            camera = self.cameras.get(scale)
+            if scale != resolution_scale and camera is not None and camera.image_cache is not None:
+                camera.image_cache.put(camera.image_key, camera.prepare_image(*image))
+        return images[self.resolution_scales.index(resolution_scale)]
+
+def readStoredCamImage(args, image_store, key):
+    return camImageTensors(args, image_store.get(key))
+
+def storeCamImages(args, cam_infos, resolution_scales, image_store):
+    """
+    Keys of the image pyramids of cam_infos in image_store. Levels missing
+    from the store are decoded on a thread pool and appended to it.
+    """
+    keys = [[imageKey(args, c, computeResolution(args, c, resolution_scale)) for resolution_scale in resolution_scales]
+            for c in cam_infos]
+    missing = [(c, view_keys) for c, view_keys in zip(cam_infos, keys) if not all(key in image_store for key in view_keys)]
+    if missing:
+        with ThreadPoolExecutor(max_workers=max(1, args.load_workers)) as executor:
+            pyramids = executor.map(lambda item: loadResizedImages(args, item[0], resolution_scales, True), missing)
+            for (c, view_keys), images in tqdm(zip(missing, pyramids), total=len(missing), desc="Storing images"):
+                for key, image in zip(view_keys, images):
+                    image_store.put(key, image)
+        image_store.commit()
+    return keys
+
+def loadCamImage(args, cam_info, resolution_scale, reopen=False, disk_cache=None):
+    return loadCamImages(args, cam_info, [resolution_scale], reopen, disk_cache)[0]
+
+def loadCam(args, id, cam_info, resolution_scale, image=None, image_cache=None, disk_cache=None, batch=None, image_loader=None):
+    if image_loader is None and image_cache is not None:
+        image_loader = partial(loadCamImage, args, cam_info, resolution_scale, True, disk_cache)
+    if image_loader is not None:
+        return Camera(colmap_id=cam_info.uid, R=cam_info.R, T=cam_info.T, 
+                      FoVx=cam_info.FovX, FoVy=cam_info.FovY, 
+                      image=None, gt_alpha_mask=None,
+                      image_name=cam_info.image_name, uid=id, data_device=args.data_device or args.device, device=args.device,
+                      image_loader=image_loader,
+                      image_cache=image_cache, resolution=computeResolution(args, cam_info, resolution_scale),
+                      batch=batch, batch_index=id)
+
+    gt_image, loaded_mask = loadCamImage(args, cam_info, resolution_scale, disk_cache=disk_cache) if image is None else image
+
     return Camera(colmap_id=cam_info.uid, R=cam_info.R, T=cam_info.T, 
                   FoVx=cam_info.FovX, FoVy=cam_info.FovY, 
                   image=gt_image, gt_alpha_mask=loaded_mask,
-                  image_name=cam_info.image_name, uid=id, data_device=args.data_device)
+                  image_name=cam_info.image_name, uid=id, data_device=args.data_device or args.device, device=args.device,
+                  batch=batch, batch_index=id)
+
+def cameraLists_from_camInfos(cam_infos, resolution_scales, args, image_cache=None, disk_cache=None,
+                              camera_lists=None, on_loaded=None, image_store=None):
+    """
+    Camera lists for every resolution scale, built in one pass over cam_infos.
+    All poses live in a single CameraBatch; cameras of the same view share
+    their pose and projection tensors across scales and only differ by image
+    level. Cameras are appended to camera_lists (if given) as soon as they are
+    ready, and on_loaded(count) is called after each view. With an
+    image_store, cameras read their images from it on demand.
+    """
+    if camera_lists is None:
+        camera_lists = {resolution_scale: [] for resolution_scale in resolution_scales}
+    if not cam_infos:
+        return camera_lists
+    batch = CameraBatch.from_cam_infos(cam_infos, args.device)
+
+    def add_cameras(id, c, images):
+        for resolution_scale, image in zip(resolution_scales, images):
+            camera = loadCam(args, id, c, resolution_scale, image, image_cache, disk_cache, batch)
+            camera_lists[resolution_scale].append(camera)
+        if on_loaded is not None:
+            on_loaded(id + 1)
 
-def cameraList_from_camInfos(cam_infos, resolution_scale, args):
-    camera_list = []
+    if image_store is not None:
+        keys = storeCamImages(args, cam_infos, resolution_scales, image_store)
+        for id, c in enumerate(cam_infos):
+            for resolution_scale, key in zip(resolution_scales, keys[id]):
+                camera_lists[resolution_scale].append(loadCam(args, id, c, resolution_scale, None, image_cache, batch=batch,
+                                                               image_loader=partial(readStoredCamImage, args, image_store, key)))
+            if on_loaded is not None:
+                on_loaded(id + 1)
+        return camera_lists
 
-    for id, c in enumerate(cam_infos):
-        camera_list.append(loadCam(args, id, c, resolution_scale))
+    if image_cache is not None:
+        # Lazy images: only the image headers are read here
+        for id, c in enumerate(cam_infos):
+            if disk_cache is not None:
+                # Not read yet, but needed by this run, so keep them from eviction
+                for resolution_scale in resolution_scales:
+                    disk_cache.touch(imageKey(args, c, computeResolution(args, c, resolution_scale)))
+            view_loader = ViewImageLoader(args, c, list(resolution_scales), disk_cache)
+            for resolution_scale in resolution_scales:
+                camera = loadCam(args, id, c, resolution_scale, None, image_cache, batch=batch,
+                                 image_loader=view_loader.loader(resolution_scale))
+                view_loader.cameras[resolution_scale] = camera
+                camera_lists[resolution_scale].append(camera)
+            if on_loaded is not None:
+                on_loaded(id + 1)
+        return camera_lists
 
-    return camera_list
+    # Decoding and resizing run on a thread pool (PIL releases the GIL for both),
+    # cameras are then created on this thread in the original order.
+    with ThreadPoolExecutor(max_workers=max(1, args.load_workers)) as executor:
+        pyramids = executor.map(lambda c: loadCamImages(args, c, resolution_scales, True, disk_cache), cam_infos)
+        for id, (c, images) in enumerate(tqdm(zip(cam_infos, pyramids), total=len(cam_infos), desc="Loading cameras")):
+            add_cameras(id, c, images)
+
+    return camera_lists
+
+def cameraList_from_camInfos(cam_infos, resolution_scale, args, image_cache=None, disk_cache=None):
+    return cameraLists_from_camInfos(cam_infos, [resolution_scale], args, image_cache, disk_cache)[resolution_scale]
 
 def camera_to_JSON(id, camera : Camera):
     Rt = np.zeros((4, 4))
@@ -80,3 +275,74 @@ def camera_to_JSON(id, camera : Camera):
         'fx' : fov2focal(camera.FovX, camera.width)
     }
     return camera_entry
+
+class ViewpointStack:
+    """
+    Draws training cameras in random order without replacement, refilling
+    from get_cameras() whenever a pass is exhausted, exactly like the former
+    viewpoint_stack.pop(randint(...)) loop in train.py. Upcoming picks are
+    drawn ahead of time on request so their images can be prefetched.
+    """
+
+    def __init__(self, get_cameras):
+        self.get_cameras = get_cameras
+        self.stack = []
+        self.upcoming = deque()
+
+    def _draw(self):
+        if not self.stack:
+            self.stack = self.get_cameras().copy()
+        return self.stack.pop(randint(0, len(self.stack)-1))
+
+    def peek(self, count):
+        while len(self.upcoming) < count:
+            self.upcoming.append(self._draw())
+        return list(self.upcoming)[:count]
+
+    def pop(self):
+        if not self.upcoming:
+            self.upcoming.append(self._draw())
+        return self.upcoming.popleft()
+
+class ViewPrefetcher:
+    """
+    Moves the ground truth images of upcoming training views to device ahead
+    of use. A worker thread fetches the stored image (decoding it for lazy
+    cameras), stages host tensors in pinned memory and issues a non-blocking
+    copy on a side stream; fetch then only makes the current stream wait for
+    that copy. Without CUDA the worker still overlaps loading and the copy to
+    device with training.
+    """
+
+    def __init__(self, device):
+        self.device = torch.device(device)
+        self.stream = torch.cuda.Stream(self.device) if self.device.type == "cuda" else None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = {}
+
+    def _stage(self, camera):
+        image = camera.stored_image()
+        if self.stream is None or image.device.type != "cpu":
+            return image.to(self.device), None
+        if not image.is_pinned():
+            image = image.pin_memory()
+        with torch.cuda.stream(self.stream):
+            image = image.to(self.device, non_blocking=True)
+            event = torch.cuda.Event()
+            event.record(self.stream)
+        return image, event
+
+    def schedule(self, cameras):
+        for camera in cameras:
+            if camera not in self.pending:
+                self.pending[camera] = self.executor.submit(self._stage, camera)
+
+    def fetch(self, camera):
+        future = self.pending.pop(camera, None)
+        if future is None:
+            return camera.fetch_image(self.device)
+        image, event = future.result()
+        if event is not None:
+            torch.cuda.current_stream(self.device).wait_event(event)
+            image.record_stream(torch.cuda.current_stream(self.device))
+        return Camera.normalize_image(image)
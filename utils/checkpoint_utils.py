@@ -0,0 +1,96 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import json
+import struct
+import numpy as np
+import torch
+
+# File layout: magic, little-endian u64 header size, JSON header padded to
+# ALIGNMENT, then one raw C-contiguous array per tensor, each starting at an
+# ALIGNMENT-aligned file offset listed in the header.
+CHECKPOINT_MAGIC = b"GSCKPT01"
+ALIGNMENT = 64
+
+TORCH_DTYPES = {
+    "float64": torch.float64,
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+    "int64": torch.int64,
+    "int32": torch.int32,
+    "uint8": torch.uint8,
+    "bool": torch.bool,
+}
+DTYPE_NAMES = {dtype: name for name, dtype in TORCH_DTYPES.items()}
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def is_tensor_file(path):
+    with open(path, "rb") as fid:
+        return fid.read(len(CHECKPOINT_MAGIC)) == CHECKPOINT_MAGIC
+
+def write_tensor_file(path, tensors, meta):
+    """
+    Write a dict of tensors plus JSON-serializable metadata.
+    :param tensors: name -> tensor, on any device.
+    :param meta: dict stored verbatim in the header.
+    """
+    entries = {}
+    offset = 0
+    for name, tensor in tensors.items():
+        nbytes = tensor.numel() * tensor.element_size()
+        entries[name] = {"dtype": DTYPE_NAMES[tensor.dtype], "shape": list(tensor.shape),
+                         "offset": offset, "nbytes": nbytes}
+        offset = align(offset + nbytes)
+
+    header = json.dumps({"meta": meta, "tensors": entries}).encode("utf-8")
+    data_start = align(len(CHECKPOINT_MAGIC) + 8 + len(header))
+    header += b" " * (data_start - len(CHECKPOINT_MAGIC) - 8 - len(header))
+
+    with open(path, "wb") as fid:
+        fid.write(CHECKPOINT_MAGIC)
+        fid.write(struct.pack("<Q", len(header)))
+        fid.write(header)
+        for name, tensor in tensors.items():
+            entry = entries[name]
+            fid.seek(data_start + entry["offset"])
+            if entry["nbytes"] > 0:
+                raw = tensor.detach().contiguous().cpu().reshape(-1).view(torch.uint8)
+                fid.write(memoryview(raw.numpy()))
+        fid.truncate(data_start + offset)
+
+def read_tensor_file(path, names=None):
+    """
+    Memory-map a file written by write_tensor_file.
+    :param names: optional predicate on tensor names, unselected tensors are
+        never touched.
+    :return: (tensors, meta), tensors are CPU tensors backed by a
+        copy-on-write mapping of the file.
+    """
+    with open(path, "rb") as fid:
+        if fid.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+            raise ValueError("Not a native checkpoint: {}".format(path))
+        header_size = struct.unpack("<Q", fid.read(8))[0]
+        header = json.loads(fid.read(header_size).decode("utf-8"))
+    data_start = len(CHECKPOINT_MAGIC) + 8 + header_size
+
+    data = np.memmap(path, dtype=np.uint8, mode="c")
+    tensors = {}
+    for name, entry in header["tensors"].items():
+        if names is not None and not names(name):
+            continue
+        dtype = TORCH_DTYPES[entry["dtype"]]
+        begin = data_start + entry["offset"]
+        raw = torch.from_numpy(data[begin:begin + entry["nbytes"]])
+        tensors[name] = raw.view(dtype).reshape(entry["shape"])
+    return tensors, header["meta"]
@@ -11,6 +11,7 @@
 
 import torch
 import sys
+import time
 from datetime import datetime
 import numpy as np
 import random
@@ -20,7 +21,12 @@ def inverse_sigmoid(x):
 
 def PILtoTorch(pil_image, resolution):
     resized_image_PIL = pil_image.resize(resolution)
-    resized_image = torch.from_numpy(np.array(resized_image_PIL)) / 255.0
+    return ArrayToTorch(np.array(resized_image_PIL))
+
+def ArrayToTorch(array, normalize=True):
+    resized_image = torch.from_numpy(array)
+    if normalize:
+        resized_image = resized_image / 255.0
     if len(resized_image.shape) == 3:
         return resized_image.permute(2, 0, 1)
     else:
@@ -62,7 +68,7 @@ def get_expon_lr_func(
     return helper
 
 def strip_lowerdiag(L):
-    uncertainty = torch.zeros((L.shape[0], 6), dtype=torch.float, device="cuda")
+    uncertainty = torch.zeros((L.shape[0], 6), dtype=torch.float, device=L.device)
 
     uncertainty[:, 0] = L[:, 0, 0]
     uncertainty[:, 1] = L[:, 0, 1]
@@ -80,7 +86,7 @@ def build_rotation(r):
 
     q = r / norm[:, None]
 
-    R = torch.zeros((q.size(0), 3, 3), device='cuda')
+    R = torch.zeros((q.size(0), 3, 3), device=r.device)
 
     r = q[:, 0]
     x = q[:, 1]
@@ -98,8 +104,23 @@ def build_rotation(r):
     R[:, 2, 2] = 1 - 2 * (x*x + y*y)
     return R
 
+def rotation_to_quaternion(R):
+    """Inverse of build_rotation, (N, 3, 3) rotation matrices to normalized (r, x, y, z) quaternions."""
+    m00, m01, m02 = R[:, 0, 0], R[:, 0, 1], R[:, 0, 2]
+    m10, m11, m12 = R[:, 1, 0], R[:, 1, 1], R[:, 1, 2]
+    m20, m21, m22 = R[:, 2, 0], R[:, 2, 1], R[:, 2, 2]
+    # Four scaled copies of q, the one with the largest leading term is stable
+    candidates = torch.stack((
+        torch.stack((1 + m00 + m11 + m22, m21 - m12, m02 - m20, m10 - m01), dim=-1),
+        torch.stack((m21 - m12, 1 + m00 - m11 - m22, m01 + m10, m02 + m20), dim=-1),
+        torch.stack((m02 - m20, m01 + m10, 1 - m00 + m11 - m22, m12 + m21), dim=-1),
+        torch.stack((m10 - m01, m02 + m20, m12 + m21, 1 - m00 - m11 + m22), dim=-1)), dim=1)
+    best = torch.argmax(torch.diagonal(candidates, dim1=1, dim2=2), dim=1)
+    q = candidates[torch.arange(R.shape[0], device=R.device), best]
+    return q / q.norm(dim=1, keepdim=True)
+
 def build_scaling_rotation(s, r):
-    L = torch.zeros((s.shape[0], 3, 3), dtype=torch.float, device="cuda")
+    L = torch.zeros((s.shape[0], 3, 3), dtype=torch.float, device=s.device)
     R = build_rotation(r)
 
     L[:,0,0] = s[:,0]
@@ -109,6 +130,171 @@ def build_scaling_rotation(s, r):
     L = R @ L
     return L
 
+def knn_brute_dist2(points, queries, k, budget_elems=1 << 25):
+    """Squared distances of the points queries (indices) to their k nearest other points, against all points."""
+    chunk_size = max(1, budget_elems // points.shape[0])
+    dist2 = torch.empty((queries.shape[0], k), dtype=points.dtype, device=points.device)
+    for start in range(0, queries.shape[0], chunk_size):
+        ids = queries[start:start + chunk_size]
+        d2 = torch.cdist(points[ids], points).square_()
+        # Exclude each query point itself
+        d2[torch.arange(ids.shape[0], device=points.device), ids] = float("inf")
+        dist2[start:start + chunk_size] = d2.topk(k, dim=1, largest=False).values
+    return dist2
+
+def knn_mean_dist2(points, k=3, max_candidates=256, budget_elems=1 << 25):
+    """
+    Mean squared distance of every point to its k nearest neighbors, the
+    device-agnostic counterpart of simple_knn's distCUDA2. Exact: candidates
+    come from the 3x3x3 grid cells around each point, with a cell size
+    adapted per point until its k-th neighbor lies within one cell, so no
+    point outside the block can be closer. Finer cells are tried while a
+    block holds more than max_candidates points. Points that no grid
+    resolves, e.g. many duplicates, are searched by brute force. No step
+    holds more than about budget_elems distances.
+    """
+    num_points = points.shape[0]
+    k = min(k, num_points - 1)
+    if k <= 0:
+        return torch.zeros(num_points, dtype=points.dtype, device=points.device)
+    device = points.device
+    origin = points.amin(dim=0)
+    extent = max((points.amax(dim=0) - origin).max().item(), 1e-12)
+    # Cell size of level 0 puts ~4 points in a cell if they filled the bounding box
+    base_size = extent * (4.0 / num_points) ** (1.0 / 3.0)
+    offsets = torch.stack(torch.meshgrid(*([torch.arange(-1, 2, device=device)] * 3), indexing="ij"), dim=-1).reshape(-1, 3)
+
+    grids = {}
+    def grid(level):
+        # Points sorted by linearized cell key, cells padded by one on every side
+        if level not in grids:
+            size = base_size * 2.0 ** level
+            dims = int(extent / size) + 3
+            if dims ** 3 >= 2 ** 62:
+                grids[level] = None
+            else:
+                cells = torch.floor((points - origin) / size).long() + 1
+                keys = (cells[:, 0] * dims + cells[:, 1]) * dims + cells[:, 2]
+                keys, order = torch.sort(keys)
+                cell_keys, counts = torch.unique_consecutive(keys, return_counts=True)
+                grids[level] = (size, dims, order, cell_keys, torch.cumsum(counts, 0) - counts, counts)
+        return grids[level]
+
+    def block(ids, cell_grid):
+        """Start and size of the occupied cells around every query."""
+        size, dims, order, cell_keys, starts, counts = cell_grid
+        neighbors = torch.floor((points[ids] - origin) / size).long()[:, None, :] + 1 + offsets[None]
+        keys = (neighbors[..., 0] * dims + neighbors[..., 1]) * dims + neighbors[..., 2]
+        pos = torch.searchsorted(cell_keys, keys).clamp_max(cell_keys.shape[0] - 1)
+        cell_counts = torch.where(cell_keys[pos] == keys, counts[pos], torch.zeros_like(pos))
+        return starts[pos], cell_counts
+
+    def nearest(ids, cell_starts, cell_counts, cell_grid):
+        """k smallest squared distances to the block candidates, padded with inf."""
+        order = cell_grid[2]
+        totals = cell_counts.sum(dim=1)
+        cell_starts, cell_counts = cell_starts.reshape(-1), cell_counts.reshape(-1)
+        pair = torch.repeat_interleave(torch.arange(cell_counts.shape[0], device=device), cell_counts)
+        index = torch.arange(pair.shape[0], device=device)
+        within = index - torch.repeat_interleave(torch.cumsum(cell_counts, 0) - cell_counts, cell_counts)
+        slot = index - torch.repeat_interleave(torch.cumsum(totals, 0) - totals, totals)
+        width = max(k, int(totals.max()))
+        candidates = torch.full((ids.shape[0] * width,), -1, dtype=torch.int64, device=device)
+        candidates[pair // offsets.shape[0] * width + slot] = order[cell_starts[pair] + within]
+        candidates = candidates.view(ids.shape[0], width)
+        d2 = (points[candidates.clamp_min(0)] - points[ids][:, None]).square().sum(dim=-1)
+        d2 = torch.where((candidates < 0) | (candidates == ids[:, None]), float("inf"), d2)
+        return d2.topk(k, dim=1, largest=False).values
+
+    dist2 = torch.empty(num_points, dtype=points.dtype, device=device)
+    pending = torch.arange(num_points, device=device)
+    # Start every point at the level whose cells would hold about two points
+    # around it, estimated from the occupancy of its level 0 cell
+    _, _, order, _, _, counts = grid(0)
+    occupancy = torch.empty(num_points, dtype=points.dtype, device=device)
+    occupancy[order] = torch.repeat_interleave(counts, counts).to(points.dtype)
+    level = torch.round(torch.log2(2.0 / occupancy) / 3.0).long()
+    # Last move of every query: -1 to finer, 1 to coarser cells. A query that
+    # was too sparse one level below is searched without candidate limit.
+    direction = torch.zeros(num_points, dtype=torch.int64, device=device)
+    uncapped = torch.zeros(num_points, dtype=torch.bool, device=device)
+    brute = []
+    while len(pending) > 0:
+        current = int(level[pending[0]])
+        queries = pending[level[pending] == current]
+        pending = pending[level[pending] != current]
+        cell_grid = grid(current)
+        if cell_grid is None:
+            brute.append(queries)
+            continue
+        size = cell_grid[0]
+        # Candidate coordinates take three values per distance
+        chunk_size = max(1, budget_elems // (4 * max_candidates))
+        for start in range(0, queries.shape[0], chunk_size):
+            ids = queries[start:start + chunk_size]
+            cell_starts, cell_counts = block(ids, cell_grid)
+            totals = cell_counts.sum(dim=1)
+            dense = (totals > max_candidates) & ~uncapped[ids]
+            sparse = [ids[:0]]
+            # Sort by block size so that padding stays small within sub-chunks
+            by_size = torch.argsort(torch.where(dense, 0, totals))[int(dense.sum()):]
+            sub_start = 0
+            while sub_start < by_size.shape[0]:
+                width = max(1, int(totals[by_size[sub_start]]))
+                sub = by_size[sub_start:sub_start + max(1, budget_elems // (4 * width))]
+                width = max(1, int(totals[sub].max()))
+                sub = sub[:max(1, budget_elems // (4 * width))]
+                sub_start += sub.shape[0]
+                values = nearest(ids[sub], cell_starts[sub], cell_counts[sub], cell_grid)
+                settled = values[:, -1] <= size * size
+                dist2[ids[sub[settled]]] = values[settled].mean(dim=1)
+                sparse.append(ids[sub[~settled]])
+
+            # Too sparse: coarser cells, too dense: finer cells
+            for moved, step in ((torch.cat(sparse), 1), (ids[dense], -1)):
+                # Turning back means the coarser of the two levels needs more
+                # than max_candidates, search it without limit
+                conflict = direction[moved] == -step
+                uncapped[moved[conflict]] = True
+                if step == -1:
+                    pending = torch.cat((pending, moved[conflict]))
+                    moved = moved[~conflict]
+                direction[moved] = step
+                level[moved] += step
+                pending = torch.cat((pending, moved))
+
+    brute = torch.cat(brute) if brute else pending
+    if len(brute) > 0:
+        dist2[brute] = knn_brute_dist2(points, brute, k, budget_elems).mean(dim=1)
+    return dist2
+
+class IterationTimer:
+    """Milliseconds between start() and end(), measured with CUDA events on CUDA devices."""
+
+    def __init__(self, device):
+        self.use_events = torch.device(device).type == "cuda"
+        if self.use_events:
+            self.start_event = torch.cuda.Event(enable_timing = True)
+            self.end_event = torch.cuda.Event(enable_timing = True)
+        self.start_time = self.end_time = 0.0
+
+    def start(self):
+        if self.use_events:
+            self.start_event.record()
+        else:
+            self.start_time = time.perf_counter()
+
+    def end(self):
+        if self.use_events:
+            self.end_event.record()
+        else:
+            self.end_time = time.perf_counter()
+
+    def elapsed_time(self):
+        if self.use_events:
+            return self.start_event.elapsed_time(self.end_event)
+        return (self.end_time - self.start_time) * 1000.0
+
 def safe_state(silent):
     old_f = sys.stdout
     class F:
@@ -130,4 +316,5 @@ def safe_state(silent):
     random.seed(0)
     np.random.seed(0)
     torch.manual_seed(0)
-    torch.cuda.set_device(torch.device("cuda:0"))
+    if torch.cuda.is_available():
+        torch.cuda.set_device(torch.device("cuda:0"))
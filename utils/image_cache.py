@@ -0,0 +1,73 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class ImageCache:
+    """
+    Thread-safe LRU cache of loaded images with a byte budget. Values are
+    produced by loader callables, either on demand in get or ahead of time on
+    a small worker pool through prefetch. The most recently inserted entry is
+    never evicted, so a single image larger than the budget still works.
+    """
+
+    def __init__(self, budget_bytes, num_workers=2):
+        self.budget_bytes = budget_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+
+    def get(self, key, loader):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            future = self.pending.get(key)
+        if future is not None:
+            return future.result()
+        return self._load(key, loader)
+
+    def put(self, key, value):
+        """Insert an already loaded value, unless key is cached or being loaded."""
+        with self.lock:
+            if key not in self.entries and key not in self.pending:
+                self._insert(key, value)
+
+    def prefetch(self, key, loader):
+        with self.lock:
+            if key in self.entries or key in self.pending:
+                return
+            self.pending[key] = self.executor.submit(self._load, key, loader)
+
+    def _load(self, key, loader):
+        try:
+            value = loader()
+        except Exception:
+            with self.lock:
+                self.pending.pop(key, None)
+            raise
+        with self.lock:
+            self.pending.pop(key, None)
+            self._insert(key, value)
+        return value
+
+    def _insert(self, key, value):
+        if key in self.entries:
+            self.size -= self.entries.pop(key).nbytes
+        self.entries[key] = value
+        self.size += value.nbytes
+        while self.size > self.budget_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.nbytes
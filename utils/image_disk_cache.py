@@ -0,0 +1,125 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import hashlib
+import uuid
+import threading
+import numpy as np
+from argparse import ArgumentParser
+
+def image_key(image_path, resolution, alpha):
+    """Hash identifying a source image (by path, mtime and size) at a resolution and alpha handling."""
+    stat = os.stat(image_path)
+    ident = "{}|{}|{}|{}x{}|{}".format(os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size,
+                                       resolution[0], resolution[1], alpha)
+    return hashlib.sha1(ident.encode("utf-8")).hexdigest()
+
+class ImageDiskCache:
+    """
+    Persistent cache of decoded, resized images stored as raw uint8 .npy
+    files. Entries are addressed by a hash of the source path, its mtime and
+    size, the target resolution and the alpha handling, so a modified source
+    image or different settings never hit a stale entry. Reads return an
+    in-memory copy, no file stays open or mapped per cached image. Reads
+    refresh an entry's mtime, which evict() uses as LRU order when trimming
+    the cache to max_bytes; entries read or written through this instance
+    are never evicted by it.
+    """
+
+    def __init__(self, cache_dir, max_bytes=0):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.touched = set()
+        self.touched_lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, image_path, resolution, alpha):
+        return image_key(image_path, resolution, alpha)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            array = np.load(path)
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        self.touch(key)
+        return array
+
+    def touch(self, key):
+        with self.touched_lock:
+            self.touched.add(key)
+
+    def put(self, key, array):
+        # Write under a unique name first so readers never see partial files
+        tmp_path = os.path.join(self.cache_dir, "{}.{}.tmp".format(key, uuid.uuid4().hex))
+        with open(tmp_path, "wb") as fid:
+            np.save(fid, np.ascontiguousarray(array, dtype=np.uint8))
+        os.replace(tmp_path, self.path(key))
+        self.touch(key)
+
+    def entries(self):
+        entries = []
+        for fname in os.listdir(self.cache_dir):
+            if fname.endswith(".npy"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, fname))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, fname))
+        return entries
+
+    def evict(self, max_bytes=None):
+        """
+        Remove least recently used entries until the cache fits max_bytes (0:
+        no limit). Entries touched by this instance are kept, so the cache
+        may stay larger than max_bytes if they alone exceed it.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, fname in entries:
+            if max_bytes <= 0 or total <= max_bytes:
+                break
+            if fname[:-len(".npy")] in self.touched:
+                continue
+            try:
+                os.remove(os.path.join(self.cache_dir, fname))
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed, total
+
+    def clear(self):
+        for fname in os.listdir(self.cache_dir):
+            if fname.endswith(".npy") or fname.endswith(".tmp"):
+                os.remove(os.path.join(self.cache_dir, fname))
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Image disk cache maintenance")
+    parser.add_argument("cache_dir", type=str)
+    parser.add_argument("--max_mb", type=int, default=0)
+    parser.add_argument("--clear", action="store_true")
+    args = parser.parse_args()
+
+    cache = ImageDiskCache(args.cache_dir)
+    if args.clear:
+        cache.clear()
+        print("Cleared " + args.cache_dir)
+    else:
+        removed, total = cache.evict(args.max_mb * 1024 * 1024)
+        print("Evicted {} entries, {:.1f} MB remaining".format(removed, total / (1024 * 1024)))
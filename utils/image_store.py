@@ -0,0 +1,108 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import json
+import threading
+import numpy as np
+from argparse import ArgumentParser
+from utils.image_disk_cache import image_key
+
+# Every image is stored as a raw HxWxC uint8 block at an ALIGNMENT-aligned
+# offset of a single data file; index.json maps image keys to offset and
+# shape. Blocks are only ever appended and the index is rewritten atomically
+# after them, so an interrupted build leaves unreferenced bytes at worst.
+ALIGNMENT = 4096
+
+class ImageStore:
+    """
+    Out-of-core store of decoded, resized images. Reads are views into a
+    memory mapping of the data file, so resident memory is bounded by the OS
+    page cache rather than by the size of the data set.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.data_path = os.path.join(store_dir, "images.bin")
+        self.index_path = os.path.join(store_dir, "index.json")
+        os.makedirs(store_dir, exist_ok=True)
+        try:
+            with open(self.index_path) as fid:
+                self.index = json.load(fid)
+        except FileNotFoundError:
+            self.index = {}
+        self.writer = None
+        self.lock = threading.Lock()
+        self.data = None
+        self.open()
+
+    key = staticmethod(image_key)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def open(self):
+        if self.index and os.path.exists(self.data_path) and os.path.getsize(self.data_path) > 0:
+            self.data = np.memmap(self.data_path, dtype=np.uint8, mode="c")
+        else:
+            # An index without data cannot be read from, start over
+            self.data = None
+            self.index = {}
+
+    def get(self, key):
+        offset, shape = self.index[key]
+        return self.data[offset:offset + int(np.prod(shape))].reshape(shape)
+
+    def put(self, key, array):
+        """Append an image, it can be read after the next commit."""
+        array = np.ascontiguousarray(array, dtype=np.uint8)
+        with self.lock:
+            if self.writer is None:
+                self.writer = open(self.data_path, "ab")
+            offset = (self.writer.tell() + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+            self.writer.write(b"\0" * (offset - self.writer.tell()))
+            self.writer.write(memoryview(array).cast("B"))
+            self.index[key] = [offset, list(array.shape)]
+
+    def commit(self):
+        with self.lock:
+            if self.writer is None:
+                return
+            self.writer.close()
+            self.writer = None
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "w") as fid:
+                json.dump(self.index, fid)
+            os.replace(tmp_path, self.index_path)
+            self.open()
+
+    def clear(self):
+        with self.lock:
+            self.data = None
+            self.index = {}
+            for path in (self.index_path, self.data_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Image store maintenance")
+    parser.add_argument("store_dir", type=str)
+    parser.add_argument("--clear", action="store_true")
+    args = parser.parse_args()
+
+    store = ImageStore(args.store_dir)
+    if args.clear:
+        store.clear()
+    size = os.path.getsize(store.data_path) if os.path.exists(store.data_path) else 0
+    print("{} images, {:.1f} MB".format(len(store), size / (1024 * 1024)))
@@ -0,0 +1,97 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import atexit
+import queue
+import threading
+import torch
+
+def snapshot_to_host(tensor):
+    """
+    Copy a tensor to host memory so it can be serialized while training keeps
+    modifying the original. Device tensors are copied non-blocking into pinned
+    memory, BackgroundWriter.submit waits for those copies before writing.
+    """
+    tensor = tensor.detach()
+    if tensor.device.type != "cuda":
+        return tensor.clone()
+    host = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+    host.copy_(tensor, non_blocking=True)
+    return host
+
+def snapshot_tree(value):
+    """
+    snapshot_to_host applied to every tensor in nested tuples, lists and
+    dicts (e.g. capture() or an optimizer state dict). Parameters stay
+    parameters so the snapshot serializes like the original.
+    """
+    if isinstance(value, torch.nn.Parameter):
+        return torch.nn.Parameter(snapshot_to_host(value), requires_grad=value.requires_grad)
+    if isinstance(value, torch.Tensor):
+        return snapshot_to_host(value)
+    if isinstance(value, (tuple, list)):
+        return type(value)(snapshot_tree(item) for item in value)
+    if isinstance(value, dict):
+        return {key: snapshot_tree(item) for key, item in value.items()}
+    return value
+
+class BackgroundWriter:
+    """
+    Runs serialization jobs on a single worker thread. At most max_pending
+    jobs are queued, submit blocks beyond that so snapshots cannot pile up in
+    host memory. Pending jobs are flushed on close and at interpreter exit.
+    """
+
+    def __init__(self, max_pending=2):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                event, func, args = job
+                if event is not None:
+                    event.synchronize()
+                func(*args)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("Background save failed") from error
+
+    def submit(self, func, *args):
+        """Run func(*args) on the worker once all device work issued so far is done."""
+        self._raise_error()
+        event = None
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            event = torch.cuda.Event()
+            event.record()
+        self.queue.put((event, func, args))
+
+    def flush(self):
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self.worker.is_alive():
+            self.queue.put(None)
+            self.worker.join()
+        self._raise_error()
@@ -0,0 +1,106 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import numpy as np
+import torch
+from plyfile import PlyData, PlyElement
+
+FLOAT32_PROPERTY_TYPES = (b"float", b"float32")
+
+def read_ply_header(path):
+    """
+    Parse the header of a PLY file.
+    :return: (format, elements, header_size) where elements is a list of
+        (name, count, [(property_type, property_name), ...]).
+    """
+    elements = []
+    ply_format = None
+    with open(path, "rb") as fid:
+        if fid.readline().strip() != b"ply":
+            raise ValueError("Not a PLY file: {}".format(path))
+        while True:
+            line = fid.readline()
+            if not line:
+                raise ValueError("Unterminated PLY header: {}".format(path))
+            elems = line.split()
+            if not elems or elems[0] in (b"comment", b"obj_info"):
+                continue
+            if elems[0] == b"end_header":
+                break
+            if elems[0] == b"format":
+                ply_format = elems[1]
+            elif elems[0] == b"element":
+                elements.append((elems[1].decode(), int(elems[2]), []))
+            elif elems[0] == b"property":
+                elements[-1][2].append((b" ".join(elems[1:-1]), elems[-1].decode()))
+        header_size = fid.tell()
+    return ply_format, elements, header_size
+
+def read_vertex_matrix(path):
+    """
+    Read the vertex element of a PLY file as an (N, K) float32 matrix.
+
+    Binary little-endian files whose first element is an all-float vertex
+    block (as written by GaussianModel.save_ply) are memory-mapped without
+    parsing the body; the matrix is then a copy-on-write view into the file.
+    Everything else falls back to plyfile.
+    :return: (matrix, property_names)
+    """
+    ply_format, elements, header_size = read_ply_header(path)
+    if ply_format == b"binary_little_endian" and elements and elements[0][0] == "vertex" \
+            and all(prop_type in FLOAT32_PROPERTY_TYPES for prop_type, _ in elements[0][2]):
+        _, count, properties = elements[0]
+        names = [name for _, name in properties]
+        if count == 0:
+            return np.zeros((0, len(names)), dtype=np.float32), names
+        matrix = np.memmap(path, dtype="<f4", mode="c", offset=header_size, shape=(count, len(names)))
+        return matrix, names
+
+    vertices = PlyData.read(path)["vertex"]
+    names = [prop.name for prop in vertices.properties]
+    matrix = np.empty((vertices.count, len(names)), dtype=np.float32)
+    for idx, name in enumerate(names):
+        matrix[:, idx] = vertices[name]
+    return matrix, names
+
+def select_columns(matrix, names, selected):
+    """
+    Columns of matrix for the given property names. A contiguous, increasing
+    run of columns is returned as a view, anything else as a copy.
+    """
+    indices = [names.index(name) for name in selected]
+    if indices and indices == list(range(indices[0], indices[0] + len(indices))):
+        return matrix[:, indices[0]:indices[0] + len(indices)]
+    return matrix[:, indices]
+
+def write_ply_columns(path, columns, attribute_names):
+    """
+    Write a binary PLY whose vertex properties are all f4.
+    :param columns: (N, k) tensors, on any device, filling consecutive
+        properties in order. None stands for 3 zero columns.
+    """
+    dtype_full = [(attribute, 'f4') for attribute in attribute_names]
+    num_points = next(column.shape[0] for column in columns if column is not None)
+
+    # The vertex element is a plain (N, K) float32 matrix reinterpreted as a
+    # structured array, each tensor is copied straight into its column block.
+    attributes = np.zeros((num_points, len(dtype_full)), dtype=np.float32)
+    attributes_view = torch.from_numpy(attributes)
+    start = 0
+    for column in columns:
+        if column is None:
+            start += 3
+            continue
+        attributes_view[:, start:start + column.shape[1]].copy_(column)
+        start += column.shape[1]
+    elements = attributes.view(dtype_full).reshape(-1)
+    el = PlyElement.describe(elements, 'vertex')
+    PlyData([el]).write(path)
@@ -12,6 +12,7 @@
 from errno import EEXIST
 from os import makedirs, path
 import os
+import shutil
 
 def mkdir_p(folder_path):
     # Creates a directory. equivalent to using mkdir -p on the command line
@@ -26,3 +27,19 @@ def mkdir_p(folder_path):
 def searchForMaxIteration(folder):
     saved_iters = [int(fname.split("_")[-1]) for fname in os.listdir(folder)]
     return max(saved_iters)
+
+def copy_if_changed(src, dst):
+    """
+    Streamed copy of src to dst, skipped if dst is a separate file with the
+    size and mtime of src. dst never shares its data with src, so writing
+    to it cannot modify the source.
+    """
+    if path.exists(dst):
+        if not path.samefile(src, dst):
+            src_stat, dst_stat = os.stat(src), os.stat(dst)
+            if (src_stat.st_size, src_stat.st_mtime_ns) == (dst_stat.st_size, dst_stat.st_mtime_ns):
+                return
+        # Also breaks hard links made by earlier versions
+        os.remove(dst)
+    shutil.copyfile(src, dst)
+    shutil.copystat(src, dst)